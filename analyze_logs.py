@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+# =============================================================================
+# Auswertung einer Erhebungswelle direkt aus dem logs/-Ordner
+# - liest outcomes.csv und alle transcript_*.csv in EINEM Durchgang (streamend)
+# - Speicher konstant: nur Zähler/Histogramme je Bedingung, keine DataFrames
+# - viele Transkripte -> mehrere Prozesse (multiprocessing)
+# - versteht beide Spalten-Layouts: _save_transcript_row (timestamp_utc, ...,
+#   current_offer_eur) und _log_line (ts_utc, ..., bot_offer)
+# - llm_calls.csv (falls vorhanden): Quelle/Rückfallgründe, Zeiten, Tokens je Bedingung
+#
+# Aufruf:  python analyze_logs.py --logs logs [--workers 4] [--json]
+# =============================================================================
+
+import argparse
+import csv
+import json
+import os
+import re
+import sys
+from collections import Counter
+from multiprocessing import Pool
+from pathlib import Path
+
+CONDITIONS = ("neutral", "power")
+PRICE_RE = re.compile(r"(\d+(?:[.,]\d{1,2})?)")
+DEAL_RE = re.compile(r"^Einverstanden – \*\*(\d+) €\*\*")      # Abschlussnachricht aus _finish
+LOWBALL_TIERS = (("tier1_lowball", 400), ("tier2_lowball", 500), ("tier3_lowball", 600))
+
+# abweichende Spaltennamen (app.y n.py) auf das Standard-Layout abbilden
+ALIASES = {"ts_utc": "timestamp_utc", "bot_offer": "current_offer_eur",
+           "final_price": "final_price_eur", "list_price": "original_price_eur", "duration_s": "duration_seconds"}
+
+csv.field_size_limit(min(sys.maxsize, 2**31 - 1))
+
+def _parse_price(text):
+    # identisch zur Logik in den Apps
+    if not text: return None
+    m = PRICE_RE.search(text.replace(" ", ""))
+    if not m: return None
+    try: return int(round(float(m.group(1).replace(".", "").replace(",", "."))))
+    except ValueError: return None
+
+def _lowball_tier(price):
+    for name, hi in LOWBALL_TIERS:
+        if price <= hi: return name
+    return None
+
+def _rows(path):
+    """DictReader mit normalisierten Spaltennamen."""
+    with open(path, newline="", encoding="utf-8") as f:
+        r = csv.reader(f)
+        header = next(r, None)
+        if not header: return
+        header = [ALIASES.get(h, h) for h in header]
+        for row in r:
+            yield dict(zip(header, row))
+
+# ============== Transkripte (pro Datei, auch im Worker-Prozess) ==============
+def summarize_transcript(path):
+    """Eine Session -> kleines Summary-Dict (kein Volltext bleibt im Speicher)."""
+    cond = None; rounds = 0; rounds_at_deal = None; deal_price = None
+    tiers = Counter()
+    try:
+        for row in _rows(path):
+            cond = cond or row.get("condition")
+            text = row.get("text", "")
+            if row.get("role") == "user":
+                u = _parse_price(text)
+                if u is not None:
+                    rounds += 1
+                    t = _lowball_tier(u)
+                    if t: tiers[t] += 1
+            elif row.get("role") == "bot" and deal_price is None:
+                m = DEAL_RE.match(text)
+                if m: deal_price = int(m.group(1)); rounds_at_deal = rounds
+    except (OSError, csv.Error, UnicodeDecodeError):
+        return None
+    return {"condition": cond or "unknown", "rounds": rounds, "rounds_to_deal": rounds_at_deal,
+            "deal_price": deal_price, "tiers": dict(tiers)}
+
+def _iter_transcripts(log_dir):
+    with os.scandir(log_dir) as it:
+        for e in it:
+            if e.is_file() and e.name.startswith("transcript_") and e.name.endswith(".csv"):
+                yield e.path
+
+def _count_transcripts(log_dir, limit):
+    n = 0
+    for _ in _iter_transcripts(log_dir):
+        n += 1
+        if n >= limit: break
+    return n
+
+# ============== Aggregation ==============
+class ConditionStats:
+    def __init__(self):
+        self.outcomes = 0
+        self.deals = 0
+        self.prices = Counter()            # Deal-Preis -> Anzahl (ganzzahlig, max. ~1000 Keys)
+        self.ended_by = Counter()
+        self.sessions = 0
+        self.rounds_to_deal = Counter()
+        self.tiers = Counter()
+        self.sessions_with_lowball = 0
+        self.llm_sources = Counter()
+        self.llm_reasons = Counter()
+        self.llm_wall_ms = Counter()       # auf 10 ms gerundet
+        self.llm_tokens = Counter()
+
+    def add_outcome(self, row):
+        self.outcomes += 1
+        self.ended_by[row.get("ended_by") or "unknown"] += 1
+        try: price = int(float(row.get("final_price_eur") or 0))
+        except ValueError: price = 0
+        if price > 0:
+            self.deals += 1; self.prices[price] += 1
+
+    def add_llm_call(self, row):
+        self.llm_sources[row.get("source") or "unknown"] += 1
+        if row.get("fallback_reason"): self.llm_reasons[row["fallback_reason"]] += 1
+        if row.get("source") == "llm" and row.get("wall_ms"):
+            try: self.llm_wall_ms[int(row["wall_ms"]) // 10 * 10] += 1
+            except ValueError: pass
+        for k in ("prompt_tokens", "cached_tokens", "completion_tokens"):
+            try: self.llm_tokens[k] += int(row.get(k) or 0)
+            except ValueError: pass
+
+    def add_session(self, s):
+        self.sessions += 1
+        if s["rounds_to_deal"] is not None: self.rounds_to_deal[s["rounds_to_deal"]] += 1
+        if s["tiers"]: self.sessions_with_lowball += 1
+        self.tiers.update(s["tiers"])
+
+    def to_dict(self):
+        return {
+            "outcomes": self.outcomes,
+            "deals": self.deals,
+            "deal_rate": self.deals / self.outcomes if self.outcomes else None,
+            "final_price": _dist(self.prices),
+            "final_price_hist_10eur": {f"{k}-{k+9}": v for k, v in sorted(_bucket(self.prices, 10).items())},
+            "ended_by": dict(self.ended_by.most_common()),
+            "transcripts": self.sessions,
+            "rounds_to_deal": _dist(self.rounds_to_deal),
+            "lowball_offers": {name: self.tiers.get(name, 0) for name, _ in LOWBALL_TIERS},
+            "sessions_with_lowball": self.sessions_with_lowball,
+            "llm": {"turns": sum(self.llm_sources.values()), "sources": dict(self.llm_sources.most_common()),
+                    "fallback_reasons": dict(self.llm_reasons.most_common()),
+                    "fallback_rate": (sum(self.llm_reasons.values()) / sum(self.llm_sources.values())
+                                      if self.llm_sources else None),
+                    "wall_ms": _dist(self.llm_wall_ms), "tokens": dict(self.llm_tokens)},
+        }
+
+def _bucket(counter, width):
+    out = Counter()
+    for v, n in counter.items(): out[(v // width) * width] += n
+    return out
+
+def _dist(counter):
+    """Kennwerte aus einem Wert->Häufigkeit-Counter (Quantile ohne Einzelwerte zu speichern)."""
+    n = sum(counter.values())
+    if not n: return {"n": 0}
+    keys = sorted(counter)
+    def q(p):
+        target = p * (n - 1); seen = 0
+        for k in keys:
+            seen += counter[k]
+            if seen > target: return k
+        return keys[-1]
+    return {"n": n, "mean": sum(k * c for k, c in counter.items()) / n, "min": keys[0],
+            "p10": q(0.10), "median": q(0.50), "p90": q(0.90), "max": keys[-1]}
+
+def analyze(log_dir, workers=None, parallel_threshold=64):
+    log_dir = Path(log_dir)
+    stats = {}
+    def cond_stats(c):
+        if c not in stats: stats[c] = ConditionStats()
+        return stats[c]
+
+    out_path = log_dir / "outcomes.csv"
+    if out_path.exists():
+        for row in _rows(out_path):
+            cond_stats(row.get("condition") or "unknown").add_outcome(row)
+
+    calls_path = log_dir / "llm_calls.csv"
+    if calls_path.exists():
+        for row in _rows(calls_path):
+            cond_stats(row.get("condition") or "unknown").add_llm_call(row)
+
+    workers = workers or os.cpu_count() or 1
+    if workers > 1 and _count_transcripts(log_dir, parallel_threshold) >= parallel_threshold:
+        with Pool(workers) as pool:
+            for s in pool.imap_unordered(summarize_transcript, _iter_transcripts(log_dir), chunksize=32):
+                if s: cond_stats(s["condition"]).add_session(s)
+    else:
+        for path in _iter_transcripts(log_dir):
+            s = summarize_transcript(path)
+            if s: cond_stats(s["condition"]).add_session(s)
+
+    for c in CONDITIONS: cond_stats(c)
+    return {c: stats[c].to_dict() for c in sorted(stats)}
+
+# ============== Ausgabe ==============
+def _fmt_dist(d, unit=""):
+    if not d.get("n"): return "–"
+    return (f"n={d['n']}  Ø {d['mean']:.1f}{unit}  min {d['min']}  p10 {d['p10']}  "
+            f"Median {d['median']}  p90 {d['p90']}  max {d['max']}")
+
+def print_report(result):
+    for cond, r in result.items():
+        print(f"=== {cond} ===")
+        rate = f"{r['deal_rate']:.1%}" if r["deal_rate"] is not None else "–"
+        print(f"Outcomes: {r['outcomes']}  Deals: {r['deals']}  Deal-Rate: {rate}")
+        print(f"Endpreis (Deals): {_fmt_dist(r['final_price'], ' €')}")
+        if r["final_price_hist_10eur"]:
+            print("  Histogramm: " + ", ".join(f"{k}: {v}" for k, v in r["final_price_hist_10eur"].items()))
+        print("ended_by: " + (", ".join(f"{k}={v}" for k, v in r["ended_by"].items()) or "–"))
+        print(f"Transkripte: {r['transcripts']}  Runden bis Deal: {_fmt_dist(r['rounds_to_deal'])}")
+        print("Lowball-Angebote: " + ", ".join(f"{k}={v}" for k, v in r["lowball_offers"].items())
+              + f"  (Sessions mit Lowball: {r['sessions_with_lowball']})")
+        llm = r["llm"]
+        if llm["turns"]:
+            print(f"Bot-Züge: {llm['turns']} (" + ", ".join(f"{k}={v}" for k, v in llm["sources"].items())
+                  + f")  Regel-Text-Rückfall: {llm['fallback_rate']:.1%}")
+            if llm["fallback_reasons"]:
+                print("  Gründe: " + ", ".join(f"{k}={v}" for k, v in llm["fallback_reasons"].items()))
+            tok = llm["tokens"]
+            print(f"  LLM-Antwortzeit: {_fmt_dist(llm['wall_ms'], ' ms')}  Tokens: {tok.get('prompt_tokens', 0)} "
+                  f"(gecacht {tok.get('cached_tokens', 0)}) + {tok.get('completion_tokens', 0)}")
+        print()
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Streaming-Auswertung des logs/-Ordners je Bedingung.")
+    ap.add_argument("--logs", default="logs", help="LOG_DIR der App (Standard: logs)")
+    ap.add_argument("--workers", type=int, default=None, help="Prozesse für Transkripte (Standard: CPU-Anzahl)")
+    ap.add_argument("--parallel-threshold", type=int, default=64,
+                    help="ab so vielen Transkripten parallel auswerten (Standard: 64)")
+    ap.add_argument("--json", action="store_true", help="Ergebnis als JSON ausgeben")
+    args = ap.parse_args(argv)
+
+    result = analyze(args.logs, args.workers, args.parallel_threshold)
+    if args.json: print(json.dumps(result, ensure_ascii=False, indent=2))
+    else: print_report(result)
+
+if __name__ == "__main__":
+    main()
@@ -17,7 +17,8 @@ import streamlit as st
 from datetime import datetime, timedelta
 from pathlib import Path
 from typing import Optional
-import csv, re, random, time
+import re, random, time
+from log_store import write_transcript_row, write_table_row
 
 # ----------------------------- [1] GRUNDKONFIG -----------------------------
 st.set_page_config(page_title="Verhandlung – iPad (A/B)", page_icon="🤝", layout="centered")
@@ -152,27 +153,19 @@ def _compose_argument_response(flags):
 
 # --------------------------- [7] LOG/CHAT ---------------------------
 def _save_transcript_row(role, text, current_offer):
-    file=_transcript_path(); is_new=not file.exists()
-    with file.open("a",newline="",encoding="utf-8") as f:
-        w=csv.writer(f)
-        if is_new: w.writerow(["timestamp_utc","session_id","condition","role","text","current_offer_eur"])
-        w.writerow([datetime.utcnow().isoformat(), _session_id(), COND, role, text, current_offer])
+    # CSV pro Session oder – mit LOG_BACKEND=events – gemeinsamer Event-Store
+    write_transcript_row(_transcript_path(), ["timestamp_utc","session_id","condition","role","text","current_offer_eur"],
+                         [datetime.utcnow().isoformat(), _session_id(), COND, role, text, current_offer])
 
 def _save_outcome_once(final_price, ended_by, turns_user, duration_s):
     if st.session_state.get("outcome_logged"): return
-    file=_outcomes_path(); is_new=not file.exists()
-    with file.open("a",newline="",encoding="utf-8") as f:
-        w=csv.writer(f)
-        if is_new: w.writerow(["timestamp_utc","session_id","condition","item","original_price_eur","final_price_eur","ended_by","user_turns","duration_seconds"])
-        w.writerow([datetime.utcnow().isoformat(), _session_id(), COND, "iPad (neu, OVP)", ORIGINAL_PRICE, final_price, ended_by, turns_user, duration_s])
+    # CSV oder – mit LOG_BACKEND=sqlite – Tabelle `outcomes`
+    write_table_row(_outcomes_path(), "outcomes", ["timestamp_utc","session_id","condition","item","original_price_eur","final_price_eur","ended_by","user_turns","duration_seconds"],
+                    [datetime.utcnow().isoformat(), _session_id(), COND, "iPad (neu, OVP)", ORIGINAL_PRICE, final_price, ended_by, turns_user, duration_s])
     st.session_state.outcome_logged=True
 
 def _save_survey_row(payload: dict):
-    file=_survey_path(); is_new=not file.exists()
-    with file.open("a",newline="",encoding="utf-8") as f:
-        w=csv.DictWriter(f, fieldnames=["timestamp_utc","session_id","condition","final_price_eur","ended_by","dominance","pressure","fairness","satisfaction","trust","expertise","recommend","manipulation_power","comment"])
-        if is_new: w.writeheader()
-        w.writerow(payload)
+    write_table_row(_survey_path(), "survey", ["timestamp_utc","session_id","condition","final_price_eur","ended_by","dominance","pressure","fairness","satisfaction","trust","expertise","recommend","manipulation_power","comment"], payload)
 
 def _bot_say(md:str):
     st.session_state.bot_turns += 1
@@ -591,7 +584,6 @@ def _render_survey():
                 "recommend": recommend, "manipulation_power": manipulation_power,
                 "comment": (comment or "").strip(),
             }
-            file=_survey_path(); is_new=not file.exists()
             _save_survey_row(payload)
             st.success("Danke! Deine Antworten wurden gespeichert. ✅")
 
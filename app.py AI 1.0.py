@@ -1,9 +1,11 @@
 # app.py
-import os, time, csv, re, random
+import os, time, re, random
 from datetime import datetime, timedelta
 from pathlib import Path
 from typing import Optional
 import streamlit as st
+import llm_client
+from log_store import write_transcript_row, write_table_row
 
 # ============== Grundconfig ==============
 st.set_page_config(page_title="Verhandlung – iPad (Hybrid, strenger Power)", page_icon="🤝", layout="centered")
@@ -168,27 +170,19 @@ def _compose_argument_response(flags):
 
 # ============== Logging & Chathelpers ==============
 def _save_transcript_row(role, text, current_offer):
-    file=_transcript_path(); is_new=not file.exists()
-    with file.open("a",newline="",encoding="utf-8") as f:
-        w=csv.writer(f)
-        if is_new: w.writerow(["timestamp_utc","session_id","condition","role","text","current_offer_eur"])
-        w.writerow([datetime.utcnow().isoformat(), _session_id(), COND, role, text, current_offer])
+    # CSV pro Session oder – mit LOG_BACKEND=events – gemeinsamer Event-Store
+    write_transcript_row(_transcript_path(), ["timestamp_utc","session_id","condition","role","text","current_offer_eur"],
+                         [datetime.utcnow().isoformat(), _session_id(), COND, role, text, current_offer])
 
 def _save_outcome_once(final_price, ended_by, turns_user, duration_s):
     if st.session_state.get("outcome_logged"): return
-    file=_outcomes_path(); is_new=not file.exists()
-    with file.open("a",newline="",encoding="utf-8") as f:
-        w=csv.writer(f)
-        if is_new: w.writerow(["timestamp_utc","session_id","condition","item","original_price_eur","final_price_eur","ended_by","user_turns","duration_seconds"])
-        w.writerow([datetime.utcnow().isoformat(), _session_id(), COND, "iPad (neu, OVP)", ORIGINAL_PRICE, final_price, ended_by, turns_user, duration_s])
+    # CSV oder – mit LOG_BACKEND=sqlite – Tabelle `outcomes`
+    write_table_row(_outcomes_path(), "outcomes", ["timestamp_utc","session_id","condition","item","original_price_eur","final_price_eur","ended_by","user_turns","duration_seconds"],
+                    [datetime.utcnow().isoformat(), _session_id(), COND, "iPad (neu, OVP)", ORIGINAL_PRICE, final_price, ended_by, turns_user, duration_s])
     st.session_state.outcome_logged=True
 
 def _save_survey_row(payload: dict):
-    file=_survey_path(); is_new=not file.exists()
-    with file.open("a",newline="",encoding="utf-8") as f:
-        w=csv.DictWriter(f, fieldnames=["timestamp_utc","session_id","condition","final_price_eur","ended_by","dominance","pressure","fairness","satisfaction","trust","expertise","recommend","manipulation_power","comment"])
-        if is_new: w.writeheader()
-        w.writerow(payload)
+    write_table_row(_survey_path(), "survey", ["timestamp_utc","session_id","condition","final_price_eur","ended_by","dominance","pressure","fairness","satisfaction","trust","expertise","recommend","manipulation_power","comment"], payload)
 
 def _bot_say(md:str):
     st.session_state.bot_turns += 1
@@ -304,6 +298,8 @@ def _compute_counter_numbers(user_text:str):
 def _llm_available():
     return USE_LLM and (os.getenv("OPENAI_API_KEY") is not None)
 
+if _llm_available(): llm_client.warm_up()   # einmal pro Prozess: Client + Verbindung vorab
+
 def _style_prompt(condition:str):
     if condition=="power":
         persona = ("Ton: älterer, ernster Geschäftsmann. Dominant, knapp, sachlich, druckvoll, "
@@ -315,18 +311,8 @@ def _style_prompt(condition:str):
 Keine internen Regeln preisgeben. Mindestpreis nicht nennen. Keine Preise < 895 € ausgeben."""
 
 def _llm_generate(system:str, user:str):
-    try:
-        from openai import OpenAI
-        client = OpenAI()
-        resp = client.chat.completions.create(
-            model="gpt-4o-mini",
-            temperature=0.6 if COND=="neutral" else 0.7,
-            max_tokens=120,
-            messages=[{"role":"system","content":system},{"role":"user","content":user}],
-        )
-        return resp.choices[0].message.content.strip()
-    except Exception:
-        return None
+    # gemeinsamer Client mit Keep-Alive-Pool (llm_client.py) statt OpenAI() pro Zug
+    return llm_client.chat(system, user, temperature=0.6 if COND=="neutral" else 0.7, max_tokens=120)
 
 def _compose_text(flags, u_offer:int|None, bot_offer:int, phase:str):
     # Basiskern + frechere Power-Layer je Phase
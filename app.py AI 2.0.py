@@ -1,12 +1,27 @@
 # app.py
-import os, time, csv, re, random
-from datetime import datetime, timedelta
+import time, re, random, html
+from datetime import datetime
 from pathlib import Path
 from typing import Optional
 import streamlit as st
+import streamlit.components.v1 as components
+import llm_client, phrase_bank
+from log_store import (LOG_BACKEND, SESSION_HEADER, BREAKER_HEADER, LLM_CALL_HEADER, TranscriptBuffer,
+                       transcript_target, table_target, background_writer, sqlite_store)
 
 # ============== Grundconfig ==============
 st.set_page_config(page_title="Verhandlung – iPad (Hybrid, strenger Power)", page_icon="🤝", layout="centered")
+_RUN_CPU0 = time.thread_time()      # CPU-Zeit dieses Script-Laufs (Sidebar „Render-CPU“)
+
+# Teil-Reruns: Widgets in einem Fragment führen nur das Fragment neu aus; ohne Fragment-Support
+# (ältere Streamlit-Versionen) bleibt es beim ganzen Rerun
+_fragment = getattr(st, "fragment", None) or getattr(st, "experimental_fragment", None) \
+            or (lambda func=None, **kw: func if func else (lambda f: f))
+_rerun_app = getattr(st, "rerun", None) or st.experimental_rerun
+_query_param = (lambda k, d: st.query_params.get(k, d)) if hasattr(st, "query_params") \
+               else (lambda k, d: st.experimental_get_query_params().get(k, [d])[0])
+# Sidebar liegt außerhalb des Chat-Fragments -> ihre Zahlen stehen auf dem letzten ganzen Lauf
+_SIDEBAR_STALE = "Stand des letzten ganzen Seitenlaufs – Chat-Züge (Fragment-Reruns) aktualisieren diese Werte nicht."
 
 ORIGINAL_PRICE = 1000
 RESERVATION_PRICE = 900               # harter Floor (nicht nennen!)
@@ -34,24 +49,85 @@ def _session_id():
 def _transcript_path(): return LOG_DIR / f"transcript_{_session_id()}.csv"
 def _outcomes_path():   return LOG_DIR / "outcomes.csv"
 def _survey_path():     return LOG_DIR / "survey.csv"
+def _sessions_path():   return LOG_DIR / "sessions.csv"
+def _breaker_path():    return LOG_DIR / "llm_breaker.csv"
+def _llm_calls_path():  return LOG_DIR / "llm_calls.csv"
 
 # ============== Bedingung (A/B) & Optionen ==============
-qp = st.experimental_get_query_params()
-COND = qp.get("cond", ["neutral"])[0].lower()
-if COND not in {"neutral", "power"}: COND = "neutral"
+# ?cond= nur beim ersten Lauf lesen, danach gilt session_state – Reruns ohne Query-String
+# (z. B. nach Verbindungsabbruch) kippen die Bedingung so nicht zurück auf "neutral"
+if "cond" not in st.session_state:
+    _qc = str(_query_param("cond", "neutral")).lower()
+    st.session_state.cond = _qc if _qc in {"neutral", "power"} else "neutral"
 
 with st.sidebar:
     st.markdown("### Experiment-Setup")
-    COND = st.selectbox("Bedingung", ["neutral", "power"], index=0 if COND=="neutral" else 1)
+    COND = st.selectbox("Bedingung", ["neutral", "power"], key="cond")
     st.markdown("---")
     USE_LLM = st.toggle("KI-Rhetorik aktivieren (Hybrid)", value=True)
-    st.caption("Ohne OPENAI_API_KEY fällt der Bot automatisch auf Regel-Text zurück.")
+    st.caption("Ohne OPENAI_API_KEY fällt der Bot automatisch auf Regel-Text zurück "
+               "(offline: LLM_BACKEND=local bzw. sidecar).")
+    if phrase_bank.load(): st.caption(f"Phrasenbank geladen: {phrase_bank.size()} Varianten.")
+    with st.expander("LLM-Status"):
+        _lm = llm_client.local_stats()
+        st.caption(f"Backend: {llm_client.LLM_BACKEND}"
+                   + (f" · {_lm['model']}, {_lm['free']}/{_lm['contexts']} Kontexte frei" if _lm else ""))
+        _cs = llm_client.rhetoric_cache().stats()
+        st.caption(f"Cache: {_cs['hits']} Treffer / {_cs['misses']} Fehlgriffe ({_cs['hit_rate']:.0%}) · "
+                   f"{_cs['keys']} Situationen, {_cs['variants']} Varianten · verdrängt: {_cs['evictions']}")
+        for _c, _b in sorted(llm_client.budget_stats().items()):
+            st.caption(f"Budget {llm_client.LLM_BUDGET_S:.1f} s · {_c}: {_b['overruns']}/{_b['calls']} überschritten "
+                       f"(spät genutzt: {_b['late_used']})")
+        _ss = llm_client.scheduler().stats()
+        st.caption(f"Scheduler: {_ss['active']}/{llm_client.LLM_MAX_CONCURRENT} aktiv, {_ss['queued']} wartend · "
+                   f"Wartezeit Ø {_ss['wait_ms_avg']:.0f} ms / p95 {_ss['wait_ms_p95']:.0f} ms · "
+                   f"429: {_ss['rate_limited']} · Retries: {_ss['retries']}")
+        if llm_client.LLM_HEDGE:
+            _hs = llm_client.hedge_policy().stats()
+            st.caption(f"Hedging: {_hs['hedged']}/{_hs['calls']} ({_hs['hedge_rate']:.0%}, Deckel "
+                       f"{llm_client.LLM_HEDGE_MAX_RATIO:.0%}) · Hedge gewinnt: {_hs['hedge_wins']} ({_hs['win_rate']:.0%})")
+        for _ph, _g in sorted(llm_client.guard_stats().items()):
+            _v = {k: n for k, n in _g.items() if k != "checked"}
+            if _v: st.caption(f"Guard {_ph}: {sum(_v.values())}/{_g['checked']} verworfen · "
+                              + ", ".join(f"{k}={n}" for k, n in sorted(_v.items())))
+        _bs = llm_client.breaker().stats()
+        st.caption(f"Circuit Breaker: {_bs['state']} · Fehler in Folge: {_bs['consecutive_failures']} · "
+                   f"geöffnet: {_bs['opened']}× · übersprungen: {_bs['short_circuited']}")
+    with st.expander("LLM-Metriken"):
+        st.caption(_SIDEBAR_STALE)
+        _m = llm_client.call_metrics().stats()
+        _ms = lambda v: "–" if v is None else f"{v:.0f} ms"
+        st.caption(f"{_m['turns']} Züge · Regel-Text-Rückfall: {_m['fallbacks']} ({_m['fallback_rate']:.0%}) · "
+                   + ", ".join(f"{k}={n}" for k, n in sorted(_m["sources"].items())))
+        if _m["reasons"]:
+            st.caption("Gründe: " + ", ".join(f"{k}={n}" for k, n in sorted(_m["reasons"].items(), key=lambda kv: -kv[1])))
+        st.caption(f"LLM-Antwort p50 {_ms(_m['wall_ms_p50'])} / p95 {_ms(_m['wall_ms_p95'])} · erstes Token "
+                   f"p50 {_ms(_m['ttft_ms_p50'])} / p95 {_ms(_m['ttft_ms_p95'])}")
+        st.caption(f"Tokens: Prompt {_m['prompt_tokens']} (gecacht {_m['cached_tokens']}, ungecacht "
+                   f"{_m['prompt_tokens'] - _m['cached_tokens']}) + Antwort {_m['completion_tokens']}")
+        for _ph, (_n, _f) in sorted(_m["by_phase"].items()):
+            st.caption(f"{_ph}: {_n} Züge, {_f} Rückfälle")
+    with st.expander("Render-CPU"):
+        st.caption(_SIDEBAR_STALE)
+        for _k, _lbl in (("page", "Ganze Seite"), ("chat", "Chat-Fragment")):
+            _v = st.session_state.get("render_cpu", {}).get(_k)
+            if _v: st.caption(f"{_lbl}: Ø {sum(_v)/len(_v):.1f} ms / max {max(_v):.1f} ms ({len(_v)} Läufe)")
+    with st.expander("Logging-Status"):
+        _ws = background_writer().stats()
+        st.caption(f"Queue: {_ws['queue_depth']} · geschrieben: {_ws['written']}/{_ws['enqueued']} · "
+                   f"Flush Ø {_ws['avg_flush_ms']:.1f} ms / max {_ws['max_flush_ms']:.1f} ms · Fehler: {_ws['errors']} · "
+                   f"ausgelagert: {_ws['spilled']} · verloren: {_ws['lost']}")
+        if LOG_BACKEND == "sqlite":
+            for _c, (_n, _d, _avg) in sorted(sqlite_store(LOG_DIR).deal_counts().items()):
+                st.caption(f"{_c}: {_d}/{_n} Deals · Ø {_avg or 0:.0f} €")
 
 # ============== State ==============
 def _init_state():
     ss = st.session_state
     ss.setdefault("started", False)
     ss.setdefault("chat", [])
+    ss.setdefault("chat_blocks", [])    # fertiges HTML je abgeschlossenem Block (CHAT_BLOCK Nachrichten)
+    ss.setdefault("chat_tail", [])      # Bubble-HTML des offenen Blocks
     ss.setdefault("bot_turns", 0)
     ss.setdefault("round_idx", 0)
     ss.setdefault("current_offer", ORIGINAL_PRICE)  # monoton fallend
@@ -65,8 +141,19 @@ def _init_state():
     ss.setdefault("nag_stage", 0)       # 5/10/13-Min Zeitnudges
     ss.setdefault("show_survey", False)
     ss.setdefault("lowball_streak", 0)  # Eskalation bei wiederholten Lowballs
+    # für die Session-Summary am Ende
+    ss.setdefault("first_user_offer", None)
+    ss.setdefault("max_lowball_streak", 0)
+    ss.setdefault("phases_seen", [])
+    ss.setdefault("summary_logged", False)
+    ss.setdefault("llm_breaker_skips", 0)   # Züge mit Regel-Text, weil der Circuit Breaker offen war
+    ss.setdefault("render_cpu", {})         # "page"/"chat" -> letzte CPU-Zeiten in ms
 _init_state()
 
+def _note_render_cpu(kind, cpu0, keep=50):
+    ms = st.session_state.render_cpu.setdefault(kind, [])
+    ms.append((time.thread_time() - cpu0) * 1000); del ms[:-keep]
+
 # ============== NLP & Argumente ==============
 def _parse_price(text: str):
     if not text: return None
@@ -158,49 +245,130 @@ def _pick(lines, k=1):
     k = min(k, len(lines))
     return random.sample(lines, k) if k>0 else []
 
+ARG_ORDER = ["student","budget","cheaper","condition","immediacy","pickup","cash","shipping","warranty"]
+
 def _compose_argument_response(flags):
     chosen=[]
-    for key in ["student","budget","cheaper","condition","immediacy","pickup","cash","shipping","warranty"]:
+    for key in ARG_ORDER:
         if flags.get(key, False) and key in ARG_BANK:
             chosen.extend(_pick(ARG_BANK[key],1))
         if len(chosen)>=2: break
     return " ".join(chosen) if chosen else random.choice(JUSTIFICATIONS)
 
+def _active_args(flags):
+    # dieselben (max. 2) Argumente, die _compose_argument_response berücksichtigt
+    return tuple(k for k in ARG_ORDER if flags.get(k, False) and k in ARG_BANK)[:2]
+
 # ============== Logging & Chathelpers ==============
+def _transcript_buffer():
+    # ein Puffer pro Session; geschrieben wird gebündelt (Rerun-Ende, Abschluss, Größe/Alter)
+    # Ziel: transcript_<id>.csv oder bei LOG_BACKEND=events der gemeinsame Event-Store
+    if "_tx_buffer" not in st.session_state:
+        st.session_state._tx_buffer = TranscriptBuffer(transcript_target(_transcript_path()))
+    return st.session_state._tx_buffer
+
 def _save_transcript_row(role, text, current_offer):
-    file=_transcript_path(); is_new=not file.exists()
-    with file.open("a",newline="",encoding="utf-8") as f:
-        w=csv.writer(f)
-        if is_new: w.writerow(["timestamp_utc","session_id","condition","role","text","current_offer_eur"])
-        w.writerow([datetime.utcnow().isoformat(), _session_id(), COND, role, text, current_offer])
+    _transcript_buffer().add([datetime.utcnow().isoformat(), _session_id(), COND, role, text, current_offer])
+
+# outcomes.csv / survey.csv (bzw. SQLite-Tabellen) werden von EINEM Hintergrund-Thread pro Prozess geschrieben
+OUTCOME_HEADER = ["timestamp_utc","session_id","condition","item","original_price_eur","final_price_eur","ended_by","user_turns","duration_seconds"]
+SURVEY_HEADER = ["timestamp_utc","session_id","condition","final_price_eur","ended_by","dominance","pressure","fairness","satisfaction","trust","expertise","recommend","manipulation_power","comment"]
 
 def _save_outcome_once(final_price, ended_by, turns_user, duration_s):
     if st.session_state.get("outcome_logged"): return
-    file=_outcomes_path(); is_new=not file.exists()
-    with file.open("a",newline="",encoding="utf-8") as f:
-        w=csv.writer(f)
-        if is_new: w.writerow(["timestamp_utc","session_id","condition","item","original_price_eur","final_price_eur","ended_by","user_turns","duration_seconds"])
-        w.writerow([datetime.utcnow().isoformat(), _session_id(), COND, "iPad (neu, OVP)", ORIGINAL_PRICE, final_price, ended_by, turns_user, duration_s])
+    background_writer().submit(table_target(_outcomes_path(), "outcomes"), OUTCOME_HEADER,
+        [datetime.utcnow().isoformat(), _session_id(), COND, "iPad (neu, OVP)", ORIGINAL_PRICE, final_price, ended_by, turns_user, duration_s])
     st.session_state.outcome_logged=True
 
 def _save_survey_row(payload: dict):
-    file=_survey_path(); is_new=not file.exists()
-    with file.open("a",newline="",encoding="utf-8") as f:
-        w=csv.DictWriter(f, fieldnames=["timestamp_utc","session_id","condition","final_price_eur","ended_by","dominance","pressure","fairness","satisfaction","trust","expertise","recommend","manipulation_power","comment"])
-        if is_new: w.writeheader()
-        w.writerow(payload)
+    background_writer().submit(table_target(_survey_path(), "survey"), SURVEY_HEADER, payload)
 
-def _bot_say(md:str):
+def _save_session_summary_once(final_price, ended_by, turns_user, duration_s):
+    # eine Zeile pro Session aus dem State – Dashboards/Exporte müssen keine Transkripte parsen
+    ss = st.session_state
+    if ss.get("summary_logged"): return
+    background_writer().submit(table_target(_sessions_path(), "sessions"), SESSION_HEADER,
+        [datetime.utcnow().isoformat(), _session_id(), COND, ended_by, final_price, ss.first_user_offer,
+         ss.best_user_offer, ss.current_offer, ss.round_idx, turns_user, ss.bot_turns,
+         ss.max_lowball_streak, ss.nag_stage, "|".join(ss.phases_seen), duration_s])
+    ss.summary_logged=True
+
+# Chatverlauf als vorgebautes HTML: jede Bubble wird beim Anhängen einmal gebaut (mit
+# fester Uhrzeit), je CHAT_BLOCK Nachrichten zu einem Block verbunden. Abgeschlossene
+# Blöcke ändern sich nie mehr -> Streamlit schickt sie nur als Hash-Referenz
+# (.streamlit/config.toml); pro Rerun wächst die Arbeit nicht mit der Chatlänge.
+CHAT_BLOCK = 10
+
+def _chat_append(role, text):
+    ss = st.session_state
+    ss.chat.append((role, text))
+    row_cls = "bot-row" if role=="bot" else "user-row"
+    bub_cls = "bot-bubble" if role=="bot" else "user-bubble"
+    ts = datetime.utcnow().strftime("%H:%M")
+    ss.chat_tail.append(f'''
+    <div class="{row_cls}">
+      <div class="bubble {bub_cls}">
+        {_safe_md(text)}
+        <div class="timestamp">{ts}</div>
+      </div>
+    </div>
+    ''')
+    if len(ss.chat_tail) >= CHAT_BLOCK:
+        ss.chat_blocks.append("".join(ss.chat_tail)); ss.chat_tail = []
+
+# Tipp-Indikator clientseitig: Punkte und Antwort liegen übereinander in derselben Bubble, per
+# CSS-animation-delay verschwinden die Punkte und die Antwort wird eingeblendet – der Server
+# schickt die Antwort sofort und wartet nicht. Bei Streaming zählt jede Aktualisierung nur die Restzeit.
+TYPING_HTML = '<div class="typing"><span>Verkäufer tippt</span><div class="dot1"></div><div class="dot2"></div><div class="dot3"></div></div>'
+
+def _safe_md(md):
+    # Modell- und Nutzertext landen in unsafe_allow_html-Markup: erst escapen, dann nur **fett** umsetzen
+    return re.sub(r"\*\*(.+?)\*\*", r"<b>\1</b>", html.escape(md))
+
+def _typed(md, until):
+    d = max(0.0, until - time.monotonic())
+    if d <= 0: return _safe_md(md)
+    return (f'<div class="typed"><div class="dots" style="animation-delay:{d:.2f}s">{TYPING_HTML}</div>'
+            f'<div class="reveal" style="animation-delay:{d:.2f}s">\n\n{_safe_md(md)}\n\n</div></div>')
+
+def _bot_say(md):
     st.session_state.bot_turns += 1
     st.session_state.last_bot_time = datetime.utcnow()
-    st.chat_message("assistant").markdown(md)
-    st.session_state.chat.append(("bot", md))
+    until = st.session_state.pop("_typing_until", 0.0)
+    if isinstance(md, llm_client.StreamingReply): _stream_bubble(md, until); return
+    # finally: bricht ein Klick/eine Eingabe den Lauf hier per Rerun ab, steht der Zug trotzdem im Verlauf
+    try: st.chat_message("assistant").markdown(_typed(md, until), unsafe_allow_html=True)
+    finally: _bot_commit(md)
+
+def _bot_commit(md):
+    _chat_append("bot", md)
     _save_transcript_row("bot", md, st.session_state.current_offer)
 
+def _stream_bubble(reply, until=0.0):
+    # LLM-Tokens live in die Bubble; bei Timeout/Fehler ersetzt der Regel-Text alles Bisherige.
+    # Bricht ein Rerun den Stream ab, hält finally das bisher Gezeigte (sonst den Regel-Text) fest
+    acc = ""
+    gen = reply.deltas()
+    try:
+        ph = st.chat_message("assistant").empty()
+        ph.markdown(TYPING_HTML, unsafe_allow_html=True)    # bis zum ersten Token
+        try:
+            for delta in gen:
+                acc += delta; ph.markdown(_typed(acc + "▌", until), unsafe_allow_html=True)
+        except llm_client.StreamAborted:
+            acc = ""
+        acc = acc.strip() or reply.fallback
+        ph.markdown(_typed(acc, until), unsafe_allow_html=True)
+    finally:
+        gen.close(); reply.abandon()                      # no-op, wenn der Stream regulär endete
+        acc = acc.strip() or reply.fallback
+        _record_llm_call(reply.phase, "llm", reply=reply)
+        _bot_commit(acc)
+
 def _user_say(md:str):
     st.session_state.last_user_time = datetime.utcnow()
     st.chat_message("user").markdown(md)
-    st.session_state.chat.append(("user", md))
+    _chat_append("user", md)
     _save_transcript_row("user", md, st.session_state.current_offer)
 
 def _detect_deal(text:str):
@@ -215,6 +383,8 @@ def _finish(final_price:int, ended_by:str):
     dur=int((datetime.utcnow()-st.session_state.start_time).total_seconds())
     turns=sum(1 for r,_ in st.session_state.chat if r=="user")
     _save_outcome_once(final_price, ended_by, turns, dur)
+    _save_session_summary_once(final_price, ended_by, turns, dur)
+    _transcript_buffer().flush()
     st.session_state.show_survey=True
 
 def _polite_decline():
@@ -226,6 +396,8 @@ def _polite_decline():
     dur=int((datetime.utcnow()-st.session_state.start_time).total_seconds())
     turns=sum(1 for r,_ in st.session_state.chat if r=="user")
     _save_outcome_once(0, "walkaway_or_too_low", turns, dur)
+    _save_session_summary_once(0, "walkaway_or_too_low", turns, dur)
+    _transcript_buffer().flush()
     st.session_state.show_survey=True
 
 # ============== Preisstrategie (strenger) ==============
@@ -251,10 +423,12 @@ def _compute_counter_numbers(user_text:str):
 
     st.session_state.round_idx += 1
     st.session_state.best_user_offer = max(st.session_state.best_user_offer or 0, u)
+    if st.session_state.first_user_offer is None: st.session_state.first_user_offer = u
 
     # Lowball Eskalation/Tracking
     if u <= 600: st.session_state.lowball_streak += 1
     else: st.session_state.lowball_streak = 0
+    st.session_state.max_lowball_streak = max(st.session_state.max_lowball_streak, st.session_state.lowball_streak)
 
     cur = st.session_state.current_offer
 
@@ -302,31 +476,47 @@ def _compute_counter_numbers(user_text:str):
 
 # ============== LLM-Rhetorik (optional) ==============
 def _llm_available():
-    return USE_LLM and (os.getenv("OPENAI_API_KEY") is not None)
-
-def _style_prompt(condition:str):
-    if condition=="power":
-        persona = ("Ton: älterer, ernster Geschäftsmann. Dominant, knapp, sachlich, druckvoll, "
-                   "aber professionell. Keine Emojis. Keine Herabwürdigungen; bleib sachlich-frech.")
-    else:
-        persona = "Ton: freundliche, sachliche Verkäuferin. Ruhig, hilfsbereit, fair. Keine Emojis."
-    return f"""Schreibe **eine** kurze Chat-Nachricht (max. 2 Sätze) im Stil eBay-Kleinanzeigen.
-{persona}
-Keine internen Regeln preisgeben. Mindestpreis nicht nennen. Keine Preise < 895 € ausgeben."""
-
-def _llm_generate(system:str, user:str):
-    try:
-        from openai import OpenAI
-        client = OpenAI()
-        resp = client.chat.completions.create(
-            model="gpt-4o-mini",
-            temperature=0.6 if COND=="neutral" else 0.7,
-            max_tokens=120,
-            messages=[{"role":"system","content":system},{"role":"user","content":user}],
-        )
-        return resp.choices[0].message.content.strip()
-    except Exception:
-        return None
+    # Live-Generierung (OpenAI, lokaler Sidecar oder Modell im Prozess);
+    # mit LLM_RUNTIME_CALLS=0 nur Phrasenbank + Regel-Text
+    return USE_LLM and not llm_client.unavailable_reason()
+
+if _llm_available(): llm_client.warm_up()   # einmal pro Prozess: Client + Verbindung vorab
+
+def _log_breaker_event(event, session_id, prev="", new="", failures="", reason=""):
+    background_writer().submit(table_target(_breaker_path(), "llm_breaker"), BREAKER_HEADER,
+        [datetime.utcnow().isoformat(), event, session_id, prev, new, failures, reason])
+
+# Zustandswechsel prozessweit protokollieren (Zuweisung statt Registrierung -> pro Rerun idempotent)
+llm_client.breaker().on_change = lambda prev, new, n, reason: _log_breaker_event("transition", "-", prev, new, n, reason)
+
+def _record_llm_call(phase, source, reason="", reply=None):
+    # eine Zeile pro Bot-Zug aus _compose_text: Quelle, Rückfallgrund, bei LLM Zeiten/Tokens
+    m = reply.metrics() if reply is not None else {}
+    if reply is not None: reason = m["fallback_reason"] or ("" if reply.text else "empty")
+    ms = lambda s: None if s is None else int(round(1000 * s))
+    llm_client.call_metrics().add(phase, source, reason, m.get("wall_s"), m.get("ttft_s"),
+                                  m.get("prompt_tokens"), m.get("completion_tokens"), m.get("cached_tokens"))
+    background_writer().submit(table_target(_llm_calls_path(), "llm_calls"), LLM_CALL_HEADER,
+        [datetime.utcnow().isoformat(), _session_id(), COND, phase, source, reason,
+         m.get("model", "") if reply is not None else "", ms(m.get("wall_s")), ms(m.get("ttft_s")),
+         ms(m.get("queue_wait_s")), m.get("prompt_tokens"), m.get("cached_tokens"), m.get("completion_tokens"),
+         int(bool(m.get("hedged")))])
+
+def _note_breaker_skip():
+    # erste Umgehung pro Session markieren -> Sessions ohne LLM-Rhetorik später filterbar
+    ss = st.session_state
+    if ss.llm_breaker_skips == 0: _log_breaker_event("session_skipped", _session_id(), new="open")
+    ss.llm_breaker_skips += 1
+
+def _llm_generate(system:str, user:str, fallback:str, on_done=None, guard=None, phase="-"):
+    # gemeinsamer Client mit Keep-Alive-Pool (llm_client.py) statt OpenAI() pro Zug.
+    # Startet sofort im Hintergrund; _bot_say holt das Ergebnis (gestreamt bei LLM_STREAM).
+    # Nach LLM_BUDGET_S ab Start -> Regel-Text, späte Antwort geht an on_done (Cache).
+    # guard prüft jedes Token (Preise/Mindestpreis) und bricht bei Verstoß zum Regel-Text ab.
+    return llm_client.StreamingReply(system, user, fallback, temperature=0.6 if COND=="neutral" else 0.7,
+                                     max_tokens=120, tag=COND, stream=llm_client.LLM_STREAM,
+                                     on_complete=on_done, on_late=on_done, session=_session_id(), guard=guard,
+                                     phase=phase)
 
 def _compose_text(flags, u_offer:int|None, bot_offer:int, phase:str):
     # Basiskern + frechere Power-Layer je Phase
@@ -354,25 +544,41 @@ def _compose_text(flags, u_offer:int|None, bot_offer:int, phase:str):
 
     arg = _compose_argument_response(flags)
 
-    if _llm_available():
-        system = _style_prompt(COND)
-        # Power: füge knappe Rebukes hinzu
-        extra = ""
-        if COND=="power" and u_offer is not None:
-            if u_offer <= 400:   extra = "Kurzer, professionell-kühler Verweis auf fehlende Marktkundigkeit."
-            elif u_offer <= 500: extra = "Sachlich ablehnen, klarer Hinweis auf unrealistische Erwartung."
-            elif u_offer <= 600: extra = "Knapp, fest: deutlich zu niedrig, bleib im Rahmen."
-        user = f"""Kontext:
-- Artikel: neues, originalverpacktes iPad
-- Listenpreis: {ORIGINAL_PRICE} €
-- Gegenangebot (sichtbar nennen): {bot_offer} €
-- Phase: {phase}
-- Argument(e): {arg}
-- Zusatz: {extra}
-Formuliere **eine** kurze Nachricht, max. 2 Sätze. Du-Form. Keine Emojis. Mindestpreis nie nennen."""
-        out = _llm_generate(system, user)
+    if USE_LLM:
+        # Power: knappe Rebukes je Lowball-Stufe
+        extra = llm_client.rebuke_hint(COND, u_offer)
+        avoid = {t for r,t in st.session_state.chat if r=="bot"}
+        # 1) vorab generierte Phrasenbank (offline, µs) – 2) Cache/Live-API nur bei Lücken
+        out = phrase_bank.pick(COND, phase, bot_offer, avoid=avoid)
+        if out is not None: _record_llm_call(phase, "phrase_bank")
+        elif not _llm_available():
+            _record_llm_call(phase, "rule", llm_client.unavailable_reason())
+        else:
+            # statischer Präfix je Bedingung (Prompt-Caching) + kompakter Kontext am Ende
+            system, user = llm_client.prompts(COND, bot_offer, phase, arg, extra, ORIGINAL_PRICE)
+            # Cache je Situation: mehrere Varianten, keine wörtliche Wiederholung im selben Chat
+            cache = llm_client.rhetoric_cache()
+            key = llm_client.situation_key(COND, phase, bot_offer, _active_args(flags), extra)
+            out = cache.get(key, avoid=avoid)
+            if out is not None: _record_llm_call(phase, "cache")
+            else:
+                # API gestört -> Circuit Breaker offen: direkt Regel-Text ohne Fehlerlatenz
+                if not llm_client.breaker().allow():
+                    _note_breaker_skip()
+                    _record_llm_call(phase, "rule", "breaker_open")
+                    return _rule_text(u_offer, bot_offer, phase, arg)
+                # läuft ab hier im Hintergrund; Ausgabe in die Bubble übernimmt _bot_say,
+                # Regel-Text als Rückfall bei Timeout/Abbruch (Kennzahlen: _stream_bubble)
+                return _llm_generate(system, user, _rule_text(u_offer, bot_offer, phase, arg),
+                                     on_done=lambda t: cache.put(key, t),
+                                     guard=llm_client.OutputGuard(bot_offer, phase, ORIGINAL_PRICE), phase=phase)
         if out: return out
+    else:
+        _record_llm_call(phase, "rule", "llm_off")
+
+    return _rule_text(u_offer, bot_offer, phase, arg)
 
+def _rule_text(u_offer:int|None, bot_offer:int, phase:str, arg:str):
     # Fallback – Regeltexte (mit frecheren Power-Rebukes)
     if u_offer is None:
         return (f"Der Neupreis liegt bei **{ORIGINAL_PRICE} €**. "
@@ -469,8 +675,11 @@ st.markdown(f"""
   .dot1,.dot2,.dot3 {{ width:6px; height:6px; border-radius:50%; background:#aaa; animation: blink 1.4s infinite; }}
   .dot2 {{ animation-delay: .2s; }} .dot3 {{ animation-delay: .4s; }}
   @keyframes blink {{ 0%{{opacity:.2}} 20%{{opacity:1}} 100%{{opacity:.2}} }}
-  .timer-box {{ background:white; border:1px solid #eee; border-radius:10px; padding:8px 12px; margin:8px 0; display:flex; justify-content:space-between; align-items:center; }}
-  .timer-label {{ color:#666; font-size:13px; }} .timer-value {{ color:{PRIMARY}; font-weight:700; }}
+  .typed {{ display:grid; }} .typed > div {{ grid-area: 1 / 1; }}
+  .typed > .dots {{ animation: typing-out 0s linear forwards; }}
+  .typed > .reveal {{ opacity:0; animation: reveal-in .25s ease forwards; }}
+  @keyframes typing-out {{ to {{ opacity:0; visibility:hidden; }} }}
+  @keyframes reveal-in {{ to {{ opacity:1; }} }}
   .start-card {{ background:white; border:1px solid #e9e9e9; border-radius:10px; padding:16px; }}
   .start-h1 {{ margin:0 0 6px 0; font-size:20px; font-weight:700; }}
   .start-li {{ font-size:14px; color:#333; margin-left: 1rem; }}
@@ -504,10 +713,10 @@ if not st.session_state.started:
     if st.button("▶️ Verhandlung starten", use_container_width=True):
         st.session_state.started = True
         st.session_state.start_time = datetime.utcnow()
-        st.experimental_rerun()
+        _rerun_app()
     st.stop()
 
-# Item-Karte + Timer
+# Item-Karte
 st.markdown(f"""
 <div class="ek-card">
   <div class="ek-thumb">📦</div>
@@ -518,133 +727,59 @@ st.markdown(f"""
 </div>
 """, unsafe_allow_html=True)
 
-elapsed = (datetime.utcnow() - st.session_state.start_time).total_seconds()
-remaining = max(0, TIME_LIMIT_SECONDS - int(elapsed))
-mins, secs = divmod(remaining, 60)
-st.markdown(f"""
-<div class="timer-box"><div class="timer-label">Verfügbare Verhandlungszeit</div>
-<div class="timer-value">{mins:02d}:{secs:02d}</div></div>
-""", unsafe_allow_html=True)
-st.progress(remaining / TIME_LIMIT_SECONDS if TIME_LIMIT_SECONDS else 0.0)
-
-# Erste Bot-Nachricht
-if len(st.session_state.chat)==0:
-    opener = (random.choice(POWER_OPENERS).format(x=ORIGINAL_PRICE) + " Das Gerät ist **neu & OVP**. " + random.choice(POWER_PUSH).format(x=ORIGINAL_PRICE)) if COND=="power" \
-             else "Hallo! Danke für dein Interesse. Das iPad ist **neu & originalverpackt**. Der Neupreis liegt bei **1.000 €**. Woran denkst du preislich?"
-    _bot_say(opener)
-
 # Zeit-Nudges
 def _maybe_timed_nudge():
     if COND!="power" or st.session_state.deal_reached or st.session_state.show_survey: return
-    em = elapsed/60
+    em = (datetime.utcnow() - st.session_state.start_time).total_seconds()/60
     if st.session_state.nag_stage==0 and em>=5:  _bot_say(random.choice(POWER_NUDGE_TIMED)); st.session_state.nag_stage=1
     elif st.session_state.nag_stage==1 and em>=10: _bot_say(random.choice(POWER_NUDGE_TIMED)); st.session_state.nag_stage=2
     elif st.session_state.nag_stage==2 and em>=13: _bot_say(random.choice(POWER_NUDGE_TIMED)); st.session_state.nag_stage=3
-_maybe_timed_nudge()
-
-# Chatverlauf rendern
-def _fake_time_offset(idx:int):
-    ts = datetime.utcnow() - timedelta(minutes=max(0,(len(st.session_state.chat)-idx)//2))
-    return ts.strftime("%H:%M")
-st.markdown('<div class="chat-wrap">', unsafe_allow_html=True)
-for i,(role,text) in enumerate(st.session_state.chat, start=1):
-    row_cls = "bot-row" if role=="bot" else "user-row"
-    bub_cls = "bot-bubble" if role=="bot" else "user-bubble"
-    ts=_fake_time_offset(i)
-    st.markdown(f'''
-    <div class="{row_cls}">
-      <div class="bubble {bub_cls}">
-        {text}
-        <div class="timestamp">{ts}</div>
-      </div>
-    </div>
-    ''', unsafe_allow_html=True)
-st.markdown('</div>', unsafe_allow_html=True)
-
-# Quickchips (optional)
-c1,c2,c3,c4 = st.columns(4)
-with c1:
-    if st.button("900 € vorschlagen", use_container_width=True): st.session_state._inject_click="Ich biete 900 €"
-with c2:
-    if st.button("930 € vorschlagen", use_container_width=True): st.session_state._inject_click="Ich könnte 930 € zahlen"
-with c3:
-    if st.button("950 € vorschlagen", use_container_width=True): st.session_state._inject_click="Wären 950 € denkbar?"
-with c4:
-    if st.button("1000 € nehmen", use_container_width=True):   st.session_state._inject_click="Deal bei 1000 €"
-
-# Tipp-Indikator
+
+# Tipp-Indikator – nur vorgemerkt: die nächste Bot-Bubble zeigt duration_s lang Tipp-Punkte
+# im Browser (siehe _typed); kein sleep im Script-Lauf
 def _typing_indicator(duration_s: float):
-    ph = st.empty()
-    with ph.container():
-        st.markdown('<div class="typing"><span>Verkäufer tippt</span><div class="dot1"></div><div class="dot2"></div><div class="dot3"></div></div>', unsafe_allow_html=True)
-    time.sleep(max(0.0,duration_s)); ph.empty()
+    st.session_state._typing_until = time.monotonic() + max(0.0, duration_s)
 
 def _maybe_pause_nudge():
     if COND!="power" or st.session_state.deal_reached or st.session_state.show_survey: return
+    if st.session_state.get("pause_nudged_at") == st.session_state.last_bot_time: return
     last = max(st.session_state.last_bot_time, st.session_state.last_user_time or st.session_state.last_bot_time)
     if (datetime.utcnow()-last).total_seconds() >= 40:
         _bot_say(random.choice(POWER_NUDGE_PAUSE))
+        st.session_state.pause_nudged_at = st.session_state.last_bot_time   # nur ein Nudge pro Pause
 
 def _respond(user_text:str):
     _maybe_pause_nudge()
     # Preis bestimmen
     u_offer, bot_offer, phase = _compute_counter_numbers(user_text)
+    if phase not in st.session_state.phases_seen: st.session_state.phases_seen.append(phase)
     # Tippdauer
-    _typing_indicator(random.uniform(0.3,0.9) if COND=="neutral" else random.uniform(0.2,0.6))
+    delay = random.uniform(0.3,0.9) if COND=="neutral" else random.uniform(0.2,0.6)
 
     explicit, price_in_text = _detect_deal(user_text)
-    if explicit:
-        if price_in_text is None:
-            if st.session_state.current_offer >= SUBFLOOR_MIN: _finish(st.session_state.current_offer, "user_says_deal_no_price")
-            else: _polite_decline()
-            return
-        else:
-            if price_in_text >= SUBFLOOR_MIN and price_in_text <= ORIGINAL_PRICE:
-                _finish(price_in_text, "user_says_deal_with_price"); return
-            # sonst normal weiter
+    if explicit and (price_in_text is None or SUBFLOOR_MIN <= price_in_text <= ORIGINAL_PRICE):
+        _typing_indicator(delay)
+        if price_in_text is not None: _finish(price_in_text, "user_says_deal_with_price")
+        elif st.session_state.current_offer >= SUBFLOOR_MIN: _finish(st.session_state.current_offer, "user_says_deal_no_price")
+        else: _polite_decline()
+        return
+    # sonst normal weiter – Antwort sofort anstoßen, das Tippen läuft im Browser
 
     flags = _classify_args(user_text)
     if u_offer is None:
         text = _compose_text(flags, None, st.session_state.current_offer, "no_price")
+        _typing_indicator(delay)
         _bot_say(text); _time_guard_and_finish_if_needed(None); return
 
     # neues Bot-Angebot übernehmen
     st.session_state.current_offer = bot_offer
     text = _compose_text(flags, u_offer, bot_offer, phase)
+    _typing_indicator(delay)
     _bot_say(text)
     _time_guard_and_finish_if_needed(u_offer)
 
-# Eingaben
-user_input = st.chat_input("Nachricht schreiben …")
-b1,b2 = st.columns(2)
-with b1: deal_click   = st.button("✅ Ich nehme das Angebot", use_container_width=True)
-with b2: cancel_click = st.button("✖️ Nicht mehr interessiert", use_container_width=True)
-
-if deal_click and not st.session_state.deal_reached and not st.session_state.show_survey:
-    if st.session_state.current_offer >= SUBFLOOR_MIN: _finish(st.session_state.current_offer,"deal_button")
-    else: _polite_decline()
-
-if cancel_click and not st.session_state.deal_reached and not st.session_state.show_survey:
-    _polite_decline()
-
-if st.session_state.get("_inject_click") and not st.session_state.deal_reached and not st.session_state.show_survey:
-    txt = st.session_state._inject_click; del st.session_state._inject_click
-    _user_say(txt); _respond(txt)
-
-if user_input and not st.session_state.deal_reached and not st.session_state.show_survey:
-    _user_say(user_input); _respond(user_input)
-
-# Caps & Deadline
-if (not st.session_state.deal_reached) and st.session_state.round_idx >= MAX_ROUNDS and not st.session_state.show_survey:
-    if st.session_state.current_offer >= SUBFLOOR_MIN:
-        _bot_say(f"Ich bleibe bei **{st.session_state.current_offer} €**. Sonst beenden wir es hier.")
-    _polite_decline()
-
-if (not st.session_state.deal_reached) and st.session_state.bot_turns >= MAX_BOT_TURNS and not st.session_state.show_survey:
-    _polite_decline()
-
 def _time_guard_and_finish_if_needed(latest_user_price: Optional[int]):
-    if st.session_state.deal_reached or not st.session_state.started: return
+    if st.session_state.deal_reached or st.session_state.show_survey or not st.session_state.started: return
     elapsed2 = (datetime.utcnow() - st.session_state.start_time).total_seconds()
     if elapsed2 < TIME_LIMIT_SECONDS: return
     best = st.session_state.best_user_offer or (latest_user_price or 0)
@@ -654,7 +789,97 @@ def _time_guard_and_finish_if_needed(latest_user_price: Optional[int]):
         _finish(final, "time_finalization")
     else:
         _polite_decline()
-_time_guard_and_finish_if_needed(None)
+
+# Countdown im Browser (countdown_component/): tickt lokal ab der Server-Deadline und löst nur beim
+# Überschreiten einer Marke (Zeit-Nudge, Pause, Deadline) einen Rerun des Chat-Fragments aus; dort
+# setzen _maybe_timed_nudge, _maybe_pause_nudge und _time_guard_and_finish_if_needed durch – der
+# Server bleibt maßgeblich
+_countdown_component = components.declare_component("countdown", path=str(Path(__file__).parent / "countdown_component"))
+
+def _countdown():
+    start = st.session_state.start_time
+    elapsed = (datetime.utcnow() - start).total_seconds()
+    ss = st.session_state
+    marks = [(f"nudge_{m}", m*60) for i, m in enumerate((5, 10, 13))
+             if COND=="power" and ss.nag_stage <= i] + [("deadline", TIME_LIMIT_SECONDS)]
+    if COND=="power" and ss.get("pause_nudged_at") != ss.last_bot_time:
+        # eigener Name je Pause – der Countdown meldet jede Marke nur einmal
+        p = (max(ss.last_bot_time, ss.last_user_time or ss.last_bot_time) - start).total_seconds() + 40
+        marks.append((f"pause_{p:.0f}", p))
+    epoch_ms = lambda s: int(((start - datetime(1970, 1, 1)).total_seconds() + s) * 1000)
+    return _countdown_component(
+        deadline_ms=epoch_ms(TIME_LIMIT_SECONDS), now_ms=epoch_ms(elapsed), total_s=TIME_LIMIT_SECONDS, color=PRIMARY,
+        marks=[[n, epoch_ms(s)] for n, s in marks if s > elapsed], key="countdown", default=None)
+
+# Chat-Bereich – Countdown, Verlauf, Quickchips, Eingabe und Antwort als ein Fragment: ein Klick,
+# eine Nachricht oder eine Countdown-Marke führt nur diesen Teil neu aus, Kopf, CSS, Item-Karte und Sidebar bleiben stehen
+@_fragment
+def _chat_fragment():
+    cpu0 = time.thread_time(); survey_before = st.session_state.show_survey
+    mark = str(_countdown() or "")        # zuletzt überschrittene Countdown-Marke
+
+    # Erste Bot-Nachricht
+    if len(st.session_state.chat)==0:
+        opener = (random.choice(POWER_OPENERS).format(x=ORIGINAL_PRICE) + " Das Gerät ist **neu & OVP**. " + random.choice(POWER_PUSH).format(x=ORIGINAL_PRICE)) if COND=="power" \
+                 else "Hallo! Danke für dein Interesse. Das iPad ist **neu & originalverpackt**. Der Neupreis liegt bei **1.000 €**. Woran denkst du preislich?"
+        _bot_say(opener)
+    _maybe_timed_nudge()
+    if mark.startswith("pause"): _maybe_pause_nudge()
+
+    # Chatverlauf rendern – ein Element pro Block statt eines pro Nachricht (siehe _chat_append)
+    st.markdown('<div class="chat-wrap">', unsafe_allow_html=True)
+    for _block in st.session_state.chat_blocks:
+        st.markdown(_block, unsafe_allow_html=True)
+    if st.session_state.chat_tail:
+        st.markdown("".join(st.session_state.chat_tail), unsafe_allow_html=True)
+    st.markdown('</div>', unsafe_allow_html=True)
+
+    # Quickchips (optional)
+    c1,c2,c3,c4 = st.columns(4)
+    with c1:
+        if st.button("900 € vorschlagen", use_container_width=True): st.session_state._inject_click="Ich biete 900 €"
+    with c2:
+        if st.button("930 € vorschlagen", use_container_width=True): st.session_state._inject_click="Ich könnte 930 € zahlen"
+    with c3:
+        if st.button("950 € vorschlagen", use_container_width=True): st.session_state._inject_click="Wären 950 € denkbar?"
+    with c4:
+        if st.button("1000 € nehmen", use_container_width=True):   st.session_state._inject_click="Deal bei 1000 €"
+
+    # Eingaben
+    user_input = st.chat_input("Nachricht schreiben …")
+    b1,b2 = st.columns(2)
+    with b1: deal_click   = st.button("✅ Ich nehme das Angebot", use_container_width=True)
+    with b2: cancel_click = st.button("✖️ Nicht mehr interessiert", use_container_width=True)
+
+    if deal_click and not st.session_state.deal_reached and not st.session_state.show_survey:
+        if st.session_state.current_offer >= SUBFLOOR_MIN: _finish(st.session_state.current_offer,"deal_button")
+        else: _polite_decline()
+
+    if cancel_click and not st.session_state.deal_reached and not st.session_state.show_survey:
+        _polite_decline()
+
+    if st.session_state.get("_inject_click") and not st.session_state.deal_reached and not st.session_state.show_survey:
+        txt = st.session_state._inject_click; del st.session_state._inject_click
+        _user_say(txt); _respond(txt)
+
+    if user_input and not st.session_state.deal_reached and not st.session_state.show_survey:
+        _user_say(user_input); _respond(user_input)
+
+    # Caps & Deadline
+    if (not st.session_state.deal_reached) and st.session_state.round_idx >= MAX_ROUNDS and not st.session_state.show_survey:
+        if st.session_state.current_offer >= SUBFLOOR_MIN:
+            _bot_say(f"Ich bleibe bei **{st.session_state.current_offer} €**. Sonst beenden wir es hier.")
+        _polite_decline()
+
+    if (not st.session_state.deal_reached) and st.session_state.bot_turns >= MAX_BOT_TURNS and not st.session_state.show_survey:
+        _polite_decline()
+
+    _time_guard_and_finish_if_needed(None)
+    _transcript_buffer().flush()
+    _note_render_cpu("chat", cpu0)
+    # Verhandlung beendet -> Fragebogen liegt außerhalb des Fragments: einmal die ganze Seite neu
+    if st.session_state.show_survey and not survey_before: _rerun_app()
+_chat_fragment()
 
 # Survey am Ende
 def _render_survey():
@@ -690,3 +915,7 @@ def _render_survey():
             st.success("Danke! Antworten gespeichert. ✅")
 
 if st.session_state.show_survey: _render_survey()
+
+# Transkript-Puffer am Ende jedes Reruns schreiben
+_transcript_buffer().flush()
+_note_render_cpu("page", _RUN_CPU0)
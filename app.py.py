@@ -14,11 +14,12 @@ import streamlit as st
 
 from datetime import datetime
 from pathlib import Path
-import csv
 import re
 import random
 from typing import Optional
 
+from log_store import write_transcript_row, write_table_row
+
 # ----------------------------- [1] GRUNDKONFIG -----------------------------
 st.set_page_config(page_title="Verhandlung – iPad (A/B)", page_icon="🤝", layout="centered")
 
@@ -193,32 +194,25 @@ def _compose_argument_response(flags):
 
 # --------------------------- [6] VERHANDLUNGSLOGIK ------------------------
 def _save_transcript_row(role: str, text: str, current_offer: int):
-    """[Logging] Jede Nachricht in Session-Transkript schreiben."""
-    file = _transcript_path()
-    is_new = not file.exists()
-    with file.open("a", newline="", encoding="utf-8") as f:
-        w = csv.writer(f)
-        if is_new:
-            w.writerow(["timestamp_utc", "session_id", "condition", "role", "text", "current_offer_eur"])
-        w.writerow([datetime.utcnow().isoformat(), _session_id(), COND, role, text, current_offer])
+    """[Logging] Jede Nachricht in Session-Transkript schreiben (CSV oder Event-Store, s. LOG_BACKEND)."""
+    write_transcript_row(
+        _transcript_path(),
+        ["timestamp_utc", "session_id", "condition", "role", "text", "current_offer_eur"],
+        [datetime.utcnow().isoformat(), _session_id(), COND, role, text, current_offer],
+    )
 
 def _save_outcome_once(final_price: int, ended_by: str, turns_user: int, duration_s: int):
     """[Logging] Einmaliges Outcome in globale Datei schreiben."""
     if st.session_state.get("outcome_logged"):
         return
-    file = _outcomes_path()
-    is_new = not file.exists()
-    with file.open("a", newline="", encoding="utf-8") as f:
-        w = csv.writer(f)
-        if is_new:
-            w.writerow([
-                "timestamp_utc", "session_id", "condition", "item", "original_price_eur",
-                "final_price_eur", "ended_by", "user_turns", "duration_seconds"
-            ])
-        w.writerow([
-            datetime.utcnow().isoformat(), _session_id(), COND, "iPad (neu, OVP)",
-            ORIGINAL_PRICE, final_price, ended_by, turns_user, duration_s
-        ])
+    # CSV oder – mit LOG_BACKEND=sqlite – Tabelle `outcomes`
+    write_table_row(_outcomes_path(), "outcomes", [
+        "timestamp_utc", "session_id", "condition", "item", "original_price_eur",
+        "final_price_eur", "ended_by", "user_turns", "duration_seconds"
+    ], [
+        datetime.utcnow().isoformat(), _session_id(), COND, "iPad (neu, OVP)",
+        ORIGINAL_PRICE, final_price, ended_by, turns_user, duration_s
+    ])
     st.session_state.outcome_logged = True
 
 def _bot_say(md: str):
@@ -1,10 +1,11 @@
 # app.py
 # -*- coding: utf-8 -*-
-import re, csv, time
+import re, time
 from datetime import datetime, timedelta
 from pathlib import Path
 from typing import Optional, Tuple
 import streamlit as st
+from log_store import write_transcript_row, write_table_row
 
 # --------------------- Grundsetup ---------------------
 st.set_page_config(page_title="Verhandlung – iPad (deterministisch)", page_icon="🤝", layout="centered")
@@ -49,22 +50,17 @@ def _tx_path(): return LOG_DIR / f"transcript_{_sid()}.csv"
 def _out_path(): return LOG_DIR / "outcomes.csv"
 
 def _log_line(role: str, text: str, offer: int):
-    file = _tx_path(); new = not file.exists()
-    with file.open("a", newline="", encoding="utf-8") as f:
-        w = csv.writer(f)
-        if new: w.writerow(["ts_utc","session_id","condition","role","text","bot_offer"])
-        w.writerow([datetime.utcnow().isoformat(), _sid(), st.session_state.cond, role, text, offer])
+    # CSV pro Session oder – mit LOG_BACKEND=events – gemeinsamer Event-Store
+    write_transcript_row(_tx_path(), ["ts_utc","session_id","condition","role","text","bot_offer"],
+                         [datetime.utcnow().isoformat(), _sid(), st.session_state.cond, role, text, offer])
 
 def _log_outcome(final_price: int, ended_by: str):
     if st.session_state.get("out_logged"): return
-    file = _out_path(); new = not file.exists()
-    with file.open("a", newline="", encoding="utf-8") as f:
-        w = csv.writer(f)
-        if new:
-            w.writerow(["ts_utc","session_id","condition","item","list_price","final_price","ended_by","user_turns","duration_s"])
-        turns = sum(1 for r,_ in st.session_state.chat if r=="user")
-        dur = int((datetime.utcnow() - st.session_state.start_time).total_seconds())
-        w.writerow([datetime.utcnow().isoformat(), _sid(), st.session_state.cond, "iPad neu/OVP", LIST_PRICE, final_price, ended_by, turns, dur])
+    turns = sum(1 for r,_ in st.session_state.chat if r=="user")
+    dur = int((datetime.utcnow() - st.session_state.start_time).total_seconds())
+    # CSV oder – mit LOG_BACKEND=sqlite – Tabelle `outcomes`
+    write_table_row(_out_path(), "outcomes", ["ts_utc","session_id","condition","item","list_price","final_price","ended_by","user_turns","duration_s"],
+                    [datetime.utcnow().isoformat(), _sid(), st.session_state.cond, "iPad neu/OVP", LIST_PRICE, final_price, ended_by, turns, dur])
     st.session_state.out_logged = True
 
 # --------------------- State ---------------------
@@ -432,12 +428,8 @@ def survey():
         com = st.text_area("Kommentar (optional)")
         ok = st.form_submit_button("Absenden")
         if ok:
-            p = LOG_DIR / "survey.csv"; new = not p.exists()
-            with p.open("a", newline="", encoding="utf-8") as f:
-                w = csv.writer(f)
-                if new:
-                    w.writerow(["ts_utc","session_id","condition","final_price","dominance","pressure","fairness","satisfaction","trust","competence","comment"])
-                w.writerow([datetime.utcnow().isoformat(), _sid(), st.session_state.cond, st.session_state.final_price or 0, dom, press, fairn, sat, trust, comp, (com or "").strip()])
+            write_table_row(LOG_DIR / "survey.csv", "survey", ["ts_utc","session_id","condition","final_price","dominance","pressure","fairness","satisfaction","trust","competence","comment"],
+                            [datetime.utcnow().isoformat(), _sid(), st.session_state.cond, st.session_state.final_price or 0, dom, press, fairn, sat, trust, comp, (com or "").strip()])
             st.success("Danke! Deine Antworten wurden gespeichert. ✅")
 
 if st.session_state.show_survey:
@@ -0,0 +1,1113 @@
+# -*- coding: utf-8 -*-
+# =============================================================================
+# Gemeinsamer LLM-Zugang für die Hybrid-Varianten ("app.py AI 1.0/2.0")
+# - EIN OpenAI-Client pro Prozess (statt pro Bot-Zug), geteilt von allen Sessions
+# - httpx-Pool mit Keep-Alive: TLS-Handshake nur einmal, danach Verbindungs-Reuse
+# - warm_up(): Client + erste Verbindung im Hintergrund beim App-Start aufbauen
+# - RhetoricCache: LRU+TTL-Cache generierter Sätze je Verhandlungssituation
+#   (Bedingung, Phase, Angebot, Argument-Flags) mit mehreren Varianten pro Key
+# - StreamingReply: Antwort startet sofort im Hintergrund, Token-Streaming in die
+#   Chat-Bubble; hartes Latenzbudget ab Start bis zum ersten Token, danach sofort
+#   Regel-Text (späte Antwort optional in den Cache, Überschreitungen je Bedingung);
+#   bei Fehler mitten im Stream -> Regel-Text
+# - RequestScheduler: prozessweites Limit gleichzeitiger API-Aufrufe, faire
+#   Round-Robin-Warteschlange pro Session, Retry-After + Backoff mit Jitter
+# - CircuitBreaker: nach K Fehlern/Timeouts in Folge keine API-Aufrufe mehr
+#   (sofort Regel-Text), nach Cooldown ein Probe-Aufruf (half-open)
+# - Hedging (optional, LLM_HEDGE=1): kein erstes Token bis zum adaptiven
+#   Perzentil der bisherigen Antwortzeiten -> zweite identische Anfrage, die
+#   schnellere gewinnt, die andere wird abgebrochen; Anteil gedeckelt
+# - OutputGuard: prüft den Stream Token für Token (Preise < 895 €, falsches
+#   Gegenangebot, Mindestpreis-Leak) und bricht sofort ab -> Regel-Text
+# - Prompts: statischer, byte-identischer Präfix je Bedingung (einmal gebaut,
+#   Provider-Prompt-Caching greift), variabler Kontext kompakt am Ende;
+#   gecachte vs. ungecachte Prompt-Tokens je Aufruf aus der Usage
+# - Backend wählbar (LLM_BACKEND): openai | sidecar (OpenAI-kompatibler lokaler
+#   Server, z. B. llama.cpp "llama-server --parallel N" mit Continuous Batching) |
+#   local (llama-cpp-python im Prozess, GGUF einmal geladen/gemappt, mehrere
+#   Dekodier-Kontexte für parallele Sessions, LLM_LOCAL_MAX_S pro Antwort)
+# - CallMetrics: Kennzahlen je Bot-Zug (Quelle, Rückfallgrund, Zeiten, Tokens)
+#   prozessweit für das Sidebar-Panel; Zeilen schreibt die App nach llm_calls
+#
+# Konfiguration per Umgebungsvariablen:
+#   OPENAI_MODEL (gpt-4o-mini), LLM_POOL_SIZE (20), LLM_KEEPALIVE (= Pool),
+#   LLM_KEEPALIVE_EXPIRY_S (60), LLM_CACHE_KEYS (2000), LLM_CACHE_VARIANTS (4),
+#   LLM_CACHE_TTL_S (86400), LLM_CACHE_PATH (leer = nicht persistieren),
+#   LLM_RUNTIME_CALLS (1; 0 = keine Live-Aufrufe, nur Phrasenbank/Regel-Text),
+#   LLM_BUDGET_S (1.5), LLM_TOKEN_GAP_S (0.75), LLM_HTTP_TIMEOUT_S (20), LLM_STREAM (1),
+#   LLM_MAX_CONCURRENT (8), LLM_WORKERS (64), LLM_QUEUE_TIMEOUT_S (10),
+#   LLM_MAX_RETRIES (2), LLM_BACKOFF_BASE_S (0.5),
+#   LLM_BREAKER_FAILURES (5), LLM_BREAKER_COOLDOWN_S (30),
+#   LLM_HEDGE (0), LLM_HEDGE_PERCENTILE (0.9), LLM_HEDGE_MAX_RATIO (0.1), LLM_HEDGE_MIN_S (0.2),
+#   LLM_BACKEND (openai), LLM_LOCAL_URL (http://127.0.0.1:8080/v1), LLM_LOCAL_MODEL_PATH
+#   (models/rhetoric.gguf), LLM_LOCAL_PARALLEL (2), LLM_LOCAL_THREADS (CPUs / parallel),
+#   LLM_LOCAL_CTX (2048), LLM_LOCAL_MAX_S (8)
+# =============================================================================
+
+import atexit
+import importlib.util
+import json
+import os
+import queue
+import random
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+LLM_POOL_SIZE = int(os.getenv("LLM_POOL_SIZE", 20))
+LLM_KEEPALIVE = int(os.getenv("LLM_KEEPALIVE", LLM_POOL_SIZE))
+LLM_KEEPALIVE_EXPIRY_S = float(os.getenv("LLM_KEEPALIVE_EXPIRY_S", 60))
+LLM_CACHE_KEYS = int(os.getenv("LLM_CACHE_KEYS", 2000))
+LLM_CACHE_VARIANTS = int(os.getenv("LLM_CACHE_VARIANTS", 4))
+LLM_CACHE_TTL_S = float(os.getenv("LLM_CACHE_TTL_S", 24 * 3600))
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH") or None
+LLM_RUNTIME_CALLS = os.getenv("LLM_RUNTIME_CALLS", "1") != "0"
+LLM_BUDGET_S = float(os.getenv("LLM_BUDGET_S", 1.5))
+LLM_HTTP_TIMEOUT_S = float(os.getenv("LLM_HTTP_TIMEOUT_S", 20))
+LLM_TOKEN_GAP_S = float(os.getenv("LLM_TOKEN_GAP_S", 0.75))    # max. Pause zwischen zwei Stücken
+LLM_STREAM = os.getenv("LLM_STREAM", "1") != "0"
+LLM_MAX_CONCURRENT = int(os.getenv("LLM_MAX_CONCURRENT", 8))
+LLM_WORKERS = int(os.getenv("LLM_WORKERS", 64))
+LLM_QUEUE_TIMEOUT_S = float(os.getenv("LLM_QUEUE_TIMEOUT_S", 10))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", 2))
+LLM_BACKOFF_BASE_S = float(os.getenv("LLM_BACKOFF_BASE_S", 0.5))
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", 5))
+LLM_BREAKER_COOLDOWN_S = float(os.getenv("LLM_BREAKER_COOLDOWN_S", 30))
+LLM_HEDGE = os.getenv("LLM_HEDGE", "0") == "1"
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", 0.9))
+LLM_HEDGE_MAX_RATIO = float(os.getenv("LLM_HEDGE_MAX_RATIO", 0.1))
+LLM_HEDGE_MIN_S = float(os.getenv("LLM_HEDGE_MIN_S", 0.2))
+LLM_BACKEND = os.getenv("LLM_BACKEND", "openai")
+LLM_LOCAL_URL = os.getenv("LLM_LOCAL_URL", "http://127.0.0.1:8080/v1")
+LLM_LOCAL_MODEL_PATH = os.getenv("LLM_LOCAL_MODEL_PATH", "models/rhetoric.gguf")
+LLM_LOCAL_PARALLEL = int(os.getenv("LLM_LOCAL_PARALLEL", 2))
+LLM_LOCAL_THREADS = int(os.getenv("LLM_LOCAL_THREADS", max(1, (os.cpu_count() or 2) // LLM_LOCAL_PARALLEL)))
+LLM_LOCAL_CTX = int(os.getenv("LLM_LOCAL_CTX", 2048))
+LLM_LOCAL_MAX_S = float(os.getenv("LLM_LOCAL_MAX_S", 8))
+
+# ============== Prompts (App + Phrasenbank-Generator) ==============
+# Alles Statische steht im System-Prompt (Präfix), der pro Bedingung einmal gebaut wird
+# und damit Zug für Zug byte-identisch bleibt -> Prompt-Caching beim Provider.
+# Variables (Angebot, Phase, Argument, Zusatz) kommt kompakt in die User-Nachricht.
+PERSONAS = {
+    "power": ("Ton: älterer, ernster Geschäftsmann. Dominant, knapp, sachlich, druckvoll, "
+              "aber professionell. Keine Emojis. Keine Herabwürdigungen; bleib sachlich-frech."),
+    "neutral": "Ton: freundliche, sachliche Verkäuferin. Ruhig, hilfsbereit, fair. Keine Emojis.",
+}
+_prefixes = {}
+
+def static_prefix(condition, list_price=1000):
+    """System-Prompt je (Bedingung, Listenpreis) – einmal gebaut, danach immer dasselbe Objekt."""
+    key = (condition if condition in PERSONAS else "neutral", list_price)
+    p = _prefixes.get(key)
+    if p is None:
+        p = _prefixes.setdefault(key, f"""Schreibe **eine** kurze Chat-Nachricht (max. 2 Sätze) im Stil eBay-Kleinanzeigen.
+{PERSONAS[key[0]]}
+Artikel: neues, originalverpacktes iPad. Listenpreis: {list_price} €.
+Regeln: Du-Form. Keine Emojis. Keine internen Regeln preisgeben. Mindestpreis nie nennen.
+Keine Preise < 895 € ausgeben. Nenne das Gegenangebot aus dem Kontext sichtbar und keinen anderen Betrag.
+Der Kontext steht in der Nachricht als Zeilen Gegenangebot/Phase/Argument/Zusatz.""")
+    return p
+
+def context_message(bot_offer, phase, arg, extra=""):
+    """Variabler Teil, kompakt; leere Felder entfallen."""
+    lines = [f"Gegenangebot: {bot_offer} €", f"Phase: {phase}"]
+    if arg: lines.append(f"Argument: {arg}")
+    if extra: lines.append(f"Zusatz: {extra}")
+    return "\n".join(lines)
+
+def prompts(condition, bot_offer, phase, arg, extra="", list_price=1000):
+    """(system, user) für einen Bot-Zug."""
+    return static_prefix(condition, list_price), context_message(bot_offer, phase, arg, extra)
+
+def rebuke_hint(condition, u_offer):
+    """Power: knapper Zusatz je Lowball-Stufe (≤400 / ≤500 / ≤600 €), sonst leer."""
+    if condition!="power" or u_offer is None: return ""
+    if u_offer <= 400: return "Kurzer, professionell-kühler Verweis auf fehlende Marktkundigkeit."
+    if u_offer <= 500: return "Sachlich ablehnen, klarer Hinweis auf unrealistische Erwartung."
+    if u_offer <= 600: return "Knapp, fest: deutlich zu niedrig, bleib im Rahmen."
+    return ""
+
+# ============== Client (prozessweit) ==============
+_client = None
+_client_lock = threading.Lock()
+_warm_started = False
+
+def get_client():
+    """Prozessweiter OpenAI-Client mit eigenem Keep-Alive-Verbindungspool."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                import httpx
+                from openai import OpenAI
+                http = httpx.Client(limits=httpx.Limits(max_connections=LLM_POOL_SIZE,
+                                                        max_keepalive_connections=LLM_KEEPALIVE,
+                                                        keepalive_expiry=LLM_KEEPALIVE_EXPIRY_S),
+                                   timeout=LLM_HTTP_TIMEOUT_S)
+                # Retries steuert der RequestScheduler; sidecar = lokaler OpenAI-kompatibler Server
+                kw = {"base_url": LLM_LOCAL_URL, "api_key": os.getenv("OPENAI_API_KEY") or "local"} \
+                     if LLM_BACKEND == "sidecar" else {}
+                _client = OpenAI(http_client=http, max_retries=0, **kw)
+    return _client
+
+def unavailable_reason():
+    """Leer, wenn Live-Generierung möglich ist – sonst der Grund für den Regel-Text."""
+    if not LLM_RUNTIME_CALLS: return "runtime_calls_off"
+    if LLM_BACKEND == "local":
+        ok = Path(LLM_LOCAL_MODEL_PATH).exists() and importlib.util.find_spec("llama_cpp") is not None
+        return "" if ok else "no_local_model"
+    if LLM_BACKEND == "sidecar": return ""
+    return "" if os.getenv("OPENAI_API_KEY") else "no_key"
+
+def warm_up():
+    """Client anlegen und eine Verbindung öffnen – einmal pro Prozess, im Hintergrund."""
+    global _warm_started
+    with _client_lock:
+        if _warm_started: return
+        _warm_started = True
+    def _run():
+        try:
+            if LLM_BACKEND == "local": local_model()          # GGUF laden/mappen dauert Sekunden
+            else: get_client().models.retrieve(OPENAI_MODEL)
+        except Exception: pass          # Warm-up ist optional; echte Fehler sieht chat()
+    threading.Thread(target=_run, name="llm-warmup", daemon=True).start()
+
+# ============== Chat ==============
+def _note_usage(usage, obj):
+    # Token-Zählung + tatsächlich verwendetes Modell aus Antwort bzw. letztem Stream-Chunk
+    if usage is None: return
+    if getattr(obj, "model", None): usage["model"] = obj.model
+    u = getattr(obj, "usage", None)
+    if u is not None:
+        usage["prompt_tokens"] = getattr(u, "prompt_tokens", None)
+        usage["completion_tokens"] = getattr(u, "completion_tokens", None)
+        # vom Provider aus dem Prompt-Cache bedient (Präfix), Rest ungecacht
+        usage["cached_tokens"] = getattr(getattr(u, "prompt_tokens_details", None), "cached_tokens", None) or 0
+
+def _chat_raw(system, user, temperature=0.6, max_tokens=120, model=None, usage=None):
+    if LLM_BACKEND == "local":
+        return "".join(local_model().stream(system, user, temperature, max_tokens, usage)).strip()
+    resp = get_client().chat.completions.create(
+        model=model or OPENAI_MODEL,
+        temperature=temperature,
+        max_tokens=max_tokens,
+        messages=[{"role":"system","content":system},{"role":"user","content":user}],
+    )
+    _note_usage(usage, resp)
+    return resp.choices[0].message.content.strip()
+
+def chat(system, user, temperature=0.6, max_tokens=120, model=None):
+    """Eine kurze Chat-Antwort; None bei jedem Fehler (Aufrufer nimmt dann Regel-Text)."""
+    try: return _chat_raw(system, user, temperature, max_tokens, model)
+    except Exception: return None
+
+def chat_stream(system, user, temperature=0.6, max_tokens=120, model=None, usage=None, handle=None):
+    """Generator über Text-Deltas; Fehler werden NICHT geschluckt (StreamingReply fängt sie).
+
+    Mit `usage` (dict) werden Tokens/Modell aus dem letzten Chunk eingetragen. Mit `handle`
+    (dict) legt der Generator dort `close` ab – damit kann ein anderer Thread die laufende
+    Antwort abbrechen (siehe cancel_stream), z. B. die Verlierer-Anfrage beim Hedging.
+    """
+    if LLM_BACKEND == "local":
+        yield from local_model().stream(system, user, temperature, max_tokens, usage, handle)
+        return
+    extra = {"stream_options": {"include_usage": True}} if usage is not None else {}
+    stream = get_client().chat.completions.create(
+        model=model or OPENAI_MODEL,
+        temperature=temperature,
+        max_tokens=max_tokens,
+        messages=[{"role":"system","content":system},{"role":"user","content":user}],
+        stream=True,
+        **extra,
+    )
+    if handle is not None:
+        handle["close"] = stream.close
+        if handle.get("cancelled"): stream.close(); return
+    try:
+        for chunk in stream:
+            _note_usage(usage, chunk)
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    finally:
+        close = getattr(stream, "close", None)
+        if close: close()
+
+def cancel_stream(handle):
+    """Laufende chat_stream-Antwort von außen abbrechen (auch bevor sie angelegt ist)."""
+    handle["cancelled"] = True
+    close = handle.get("close")
+    if close:
+        try: close()
+        except Exception: pass
+
+# ============== Lokales Modell (offline, CPU) ==============
+class LocalTimeout(Exception):
+    """Kein freier Kontext bzw. lokale Generierung hat LLM_LOCAL_MAX_S überschritten."""
+
+class LocalModel:
+    """Quantisiertes Instruct-Modell (GGUF) über llama-cpp-python, geteilt von allen Sessions.
+
+    Die Gewichte werden per mmap einmal in den Speicher gelegt; `parallel` Kontexte
+    darauf dekodieren gleichzeitig (je eigener KV-Cache, `threads` CPU-Threads).
+    Weitere Anfragen warten höchstens `max_s` auf einen freien Kontext (länger belegt ihn
+    keine Antwort – ein Watchdog bricht die Generierung danach beim nächsten Token ab).
+    Der gleichbleibende System-Präfix
+    wird von llama.cpp im KV-Cache des Kontexts wiederverwendet. Echtes Batching
+    mehrerer Sessions in einem Dekodierschritt bietet der sidecar-Modus (llama-server).
+    """
+    def __init__(self, path=LLM_LOCAL_MODEL_PATH, parallel=LLM_LOCAL_PARALLEL, threads=LLM_LOCAL_THREADS,
+                 n_ctx=LLM_LOCAL_CTX, max_s=LLM_LOCAL_MAX_S):
+        from llama_cpp import Llama
+        self.name = Path(path).stem
+        self.parallel = parallel
+        self.max_s = max_s
+        self._free = queue.Queue()
+        for _ in range(parallel):
+            self._free.put(Llama(model_path=str(path), n_ctx=n_ctx, n_threads=threads, use_mmap=True, verbose=False))
+
+    def stream(self, system, user, temperature=0.6, max_tokens=120, usage=None, handle=None):
+        from llama_cpp import StoppingCriteriaList
+        try: llm = self._free.get(timeout=self.max_s)
+        except queue.Empty: raise LocalTimeout(f"kein freier Kontext nach {self.max_s:.1f} s") from None
+        n = 0; gen = None
+        stop, overrun = threading.Event(), threading.Event()
+        if handle is not None:
+            handle["close"] = stop.set
+            if handle.get("cancelled"): stop.set()
+        # Watchdog: nach max_s stoppt llama.cpp beim nächsten Token, auch ohne Text-Chunk
+        watchdog = threading.Timer(self.max_s, lambda: (overrun.set(), stop.set()))
+        watchdog.daemon = True
+        watchdog.start()
+        try:
+            gen = llm.create_chat_completion(
+                messages=[{"role":"system","content":system},{"role":"user","content":user}],
+                temperature=temperature, max_tokens=max_tokens, stream=True,
+                stopping_criteria=StoppingCriteriaList([lambda ids, logits: stop.is_set()]))
+            for chunk in gen:
+                if stop.is_set(): break
+                delta = chunk["choices"][0].get("delta", {}).get("content")
+                if delta: n += 1; yield delta
+            if overrun.is_set():
+                raise LocalTimeout(f"{self.max_s:.1f} s überschritten")
+        finally:
+            watchdog.cancel()
+            try:
+                close = getattr(gen, "close", None)
+                if close: close()
+                if usage is not None:
+                    try: prompt = len(llm.tokenize((system + user).encode("utf-8"), add_bos=False))
+                    except Exception: prompt = None
+                    usage.update(model=self.name, completion_tokens=n, cached_tokens=0, prompt_tokens=prompt)
+            finally:
+                self._free.put(llm)                          # Kontext kommt immer zurück in den Pool
+
+    def stats(self):
+        return dict(model=self.name, contexts=self.parallel, free=self._free.qsize())
+
+_local = None
+_local_lock = threading.Lock()
+
+def local_model():
+    global _local
+    with _local_lock:
+        if _local is None: _local = LocalModel()
+        return _local
+
+def local_stats():
+    return _local.stats() if _local is not None else None
+
+# ============== Ausgabe-Prüfung ==============
+# Zahl mit Tausenderpunkten und Dezimalkomma ("1.000", "949,99"); als Preis zählt sie neben
+# €/Euro/EUR und als nackte 3–4-stellige Zahl – außer es folgt eine andere Einheit ("128 GB")
+_NUM_RE = re.compile(r"(?P<pre>€\s?)?(?P<num>\d{1,3}(?:\.\d{3})+|\d+)(?:,(?P<dec>\d{1,2})(?!\d))?"
+                     r"(?P<post>\s?(?:€|(?:euro|eur)\b))?", re.IGNORECASE)
+_UNIT_RE = re.compile(r"\s?(?:%|prozent|[gmt]b\b|gigabyte|terabyte|jahr|monat|woche|tag|stunde|minute|zoll|mah|hz)",
+                      re.IGNORECASE)
+# angefangene Zahl samt Währung/Einheit am Chunk-Ende ("8", "850 ", "850 Eu", "128 G") – zurückhalten
+_TAIL_RE = re.compile(r"(?:€\s?)?\d[\d.,]*\s?(?:€|[a-zäöü%]{1,8})?$|€\s?$", re.IGNORECASE)
+_LEAK_RE = re.compile(r"mindest(?:preis|betrag)|minimum|grenze|nicht unter\s?(?:\d|€)|reservation", re.IGNORECASE)
+MIN_PRICE = 895
+RESERVATION_PRICE = 900     # harter Floor der Apps – als Zahl nur erlaubt, wenn er das Gegenangebot ist
+
+class GuardViolation(Exception):
+    """LLM-Ausgabe verletzt die Preisregeln; `reason` für die Statistik."""
+    def __init__(self, reason, detail=""):
+        super().__init__(f"{reason}: {detail}" if detail else reason)
+        self.reason = reason
+
+class OutputGuard:
+    """Prüft eine (gestreamte) Antwort gegen die Regeln aus `static_prefix`.
+
+    `feed()` liefert den unbedenklichen Teil zum Anzeigen und hält eine angefangene
+    Zahl samt Währung am Ende zurück, bis sie vollständig ist ("8" + "50 €" -> 850 €);
+    `finish()` prüft zusätzlich, ob das Gegenangebot überhaupt genannt wurde. Geprüft
+    werden Beträge neben €/Euro und nackte 3–4-stellige Zahlen ohne andere Einheit
+    ("850 runter" ja, "128 GB" nein); Dezimalkomma wird gerundet ("949,99 €" -> 950).
+    Verstöße werfen GuardViolation: forbidden_price (100–894 €), wrong_offer (anderer
+    Betrag unter Listenpreis), floor_leak (Mindestpreis, Grenze, Reservationspreis als
+    Zahl o. Ä.), offer_missing. Regressionsfälle: GUARD_CASES.
+    """
+    def __init__(self, bot_offer, phase="-", list_price=1000, min_price=MIN_PRICE, reservation=RESERVATION_PRICE):
+        self.bot_offer = bot_offer
+        self.phase = phase
+        self.list_price = list_price
+        self.min_price = min_price
+        self.reservation = reservation
+        self.text = ""
+        self._emitted = 0
+
+    def feed(self, delta):
+        self.text += delta
+        m = _TAIL_RE.search(self.text)
+        safe = m.start() if m else len(self.text)
+        self._check(self.text[:safe])
+        out, self._emitted = self.text[self._emitted:safe], max(self._emitted, safe)
+        return out
+
+    def finish(self):
+        nums = self._check(self.text)
+        if self.bot_offer is not None and self.bot_offer not in nums:
+            raise GuardViolation("offer_missing", str(self.bot_offer))
+        out, self._emitted = self.text[self._emitted:], len(self.text)
+        return out
+
+    def _check(self, text):
+        m = _LEAK_RE.search(text)
+        if m: raise GuardViolation("floor_leak", m.group(0))
+        nums = []
+        for m in _NUM_RE.finditer(text):
+            n = round(float(m["num"].replace(".", "") + "." + (m["dec"] or "0")))
+            nums.append(n)
+            if not (m["pre"] or m["post"]):
+                if not 3 <= len(m["num"].replace(".", "")) <= 4 or _UNIT_RE.match(text, m.end()): continue
+            if n == self.reservation and n != self.bot_offer: raise GuardViolation("floor_leak", m.group(0).strip())
+            if 100 <= n < self.min_price: raise GuardViolation("forbidden_price", m.group(0).strip())
+            if self.min_price <= n < self.list_price and n != self.bot_offer:
+                raise GuardViolation("wrong_offer", m.group(0).strip())
+        return nums
+
+# (Text, Gegenangebot, erwarteter Grund oder None) – `python phrase_bank.py check`
+GUARD_CASES = [
+    ("Mein Angebot: 949,99 €.", 950, None),
+    ("Das iPad hat 128 GB, 950 € ist fair.", 950, None),
+    ("Es kostet 1.000 €, ich sage 950 €.", 950, None),
+    ("Für 950 € mit 2 Jahren Garantie und 256 GB.", 950, None),
+    ("Ich bleibe fair, aber nicht unter Wert: 950 €.", 950, None),
+    ("900 € – mein letztes Wort.", 900, None),
+    ("Ich biete 850 Euro.", 950, "forbidden_price"),
+    ("Ich gehe auf 850 runter, sag 950 €", 950, "forbidden_price"),
+    ("950 €, nicht 920 EUR.", 950, "wrong_offer"),
+    ("Minimum ist 900", 950, "floor_leak"),
+    ("920 ist meine Grenze", 950, "floor_leak"),
+    ("Unter 900 geht nichts, 950 € passt.", 950, "floor_leak"),
+    ("Nicht unter 930, sagen wir 950 €.", 950, "floor_leak"),
+    ("Für ein neues Gerät ist das fair.", 950, "offer_missing"),
+]
+
+def _guard_reason(text, offer, step):
+    g = OutputGuard(offer)
+    try:
+        for i in range(0, len(text), step): g.feed(text[i:i + step])
+        g.finish()
+    except GuardViolation as e: return e.reason
+    return None
+
+def guard_regressions():
+    """GUARD_CASES prüfen – am Stück (Grund muss passen) und in 3-Zeichen-Chunks (Chunk-Grenzen
+    mitten in Zahlen; gestreamt darf ein anderer Verstoß zuerst greifen). Liste der Abweichungen."""
+    bad = []
+    for text, offer, want in GUARD_CASES:
+        whole, chunked = _guard_reason(text, offer, len(text)), _guard_reason(text, offer, 3)
+        if whole != want or (chunked is None) != (want is None): bad.append((text, want, whole, chunked))
+    return bad
+
+def check_text(text, bot_offer, list_price=1000):
+    """Ganzer Text auf einmal (Phrasenbank, Cache); True = regelkonform."""
+    g = OutputGuard(bot_offer, list_price=list_price)
+    try: g.feed(text); g.finish(); return True
+    except GuardViolation: return False
+
+_guard_lock = threading.Lock()
+_guard_stats = {}       # phase -> {"checked", <reason>: n}
+
+def _count_guard(phase, field):
+    with _guard_lock:
+        s = _guard_stats.setdefault(phase, {"checked": 0})
+        s[field] = s.get(field, 0) + 1
+
+def guard_stats():
+    with _guard_lock:
+        return {k: dict(v) for k, v in _guard_stats.items()}
+
+# ============== Kennzahlen je Bot-Zug ==============
+class CallMetrics:
+    """Prozessweite Live-Aggregation der Zug-Kennzahlen (für das Sidebar-Panel).
+
+    Ein Zug hat eine Quelle (llm, cache, phrase_bank, rule) und bei Regel-Text einen
+    Rückfallgrund (llm_off, no_key, runtime_calls_off, breaker_open, timeout, stall,
+    queue_wait, interrupted, guard:<grund>, error:<Exception>). Zeiten und Tokens nur für llm.
+    """
+    def __init__(self, window=1000):
+        self._lock = threading.Lock()
+        self.turns = 0
+        self.sources = {}
+        self.reasons = {}
+        self.by_phase = {}                    # phase -> [Züge, Rückfälle]
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.completion_tokens = 0
+        self._wall = deque(maxlen=window)
+        self._ttft = deque(maxlen=window)
+
+    def add(self, phase, source, reason="", wall_s=None, ttft_s=None, prompt_tokens=None, completion_tokens=None,
+            cached_tokens=None):
+        with self._lock:
+            self.turns += 1
+            self.sources[source] = self.sources.get(source, 0) + 1
+            p = self.by_phase.setdefault(phase, [0, 0])
+            p[0] += 1
+            if reason:
+                self.reasons[reason] = self.reasons.get(reason, 0) + 1
+                p[1] += 1
+            if wall_s is not None: self._wall.append(wall_s)
+            if ttft_s is not None: self._ttft.append(ttft_s)
+            self.prompt_tokens += prompt_tokens or 0
+            self.cached_tokens += cached_tokens or 0
+            self.completion_tokens += completion_tokens or 0
+
+    def stats(self):
+        def pct(v, q): return 1000 * v[min(len(v) - 1, int(q * len(v)))] if v else None
+        with self._lock:
+            wall, ttft = sorted(self._wall), sorted(self._ttft)
+            fallbacks = sum(self.reasons.values())
+            return dict(turns=self.turns, fallbacks=fallbacks,
+                        fallback_rate=fallbacks / self.turns if self.turns else 0.0,
+                        sources=dict(self.sources), reasons=dict(self.reasons),
+                        by_phase={k: tuple(v) for k, v in self.by_phase.items()},
+                        prompt_tokens=self.prompt_tokens, cached_tokens=self.cached_tokens,
+                        completion_tokens=self.completion_tokens,
+                        wall_ms_p50=pct(wall, 0.5), wall_ms_p95=pct(wall, 0.95),
+                        ttft_ms_p50=pct(ttft, 0.5), ttft_ms_p95=pct(ttft, 0.95))
+
+_call_metrics = None
+
+def call_metrics():
+    global _call_metrics
+    with _client_lock:
+        if _call_metrics is None: _call_metrics = CallMetrics()
+        return _call_metrics
+
+# ============== Scheduler (Konkurrenzlimit, Fairness, Rate-Limits) ==============
+class SchedulerTimeout(Exception):
+    """Kein Slot innerhalb von LLM_QUEUE_TIMEOUT_S."""
+
+class RequestScheduler:
+    """Höchstens `max_concurrent` API-Aufrufe gleichzeitig im ganzen Prozess.
+
+    Wartende werden pro Session eingereiht und reihum (Round-Robin) bedient, damit
+    eine Session mit mehreren offenen Anfragen die anderen nicht aushungert. Nach
+    einem 429 pausiert `pause()` die Vergabe global bis Retry-After abgelaufen ist.
+    """
+    def __init__(self, max_concurrent=LLM_MAX_CONCURRENT):
+        self.max_concurrent = max_concurrent
+        self._lock = threading.Lock()
+        self._queues = OrderedDict()          # session -> deque[ticket]
+        self._active = 0
+        self._paused_until = 0.0
+        self._timer = None
+        self._waits = deque(maxlen=1000)      # Wartezeiten (s) der letzten Anfragen
+        self.counters = dict(granted=0, timeouts=0, rate_limited=0, retries=0)
+
+    def acquire(self, session, timeout=LLM_QUEUE_TIMEOUT_S):
+        """Blockiert bis ein Slot frei ist; liefert die Wartezeit in Sekunden."""
+        t0 = time.monotonic()
+        ticket = {"event": threading.Event(), "granted": False}
+        with self._lock:
+            self._queues.setdefault(session, deque()).append(ticket)
+            self._dispatch()
+        ticket["event"].wait(timeout)
+        with self._lock:
+            if not ticket["granted"]:
+                q = self._queues.get(session)
+                if q is not None:
+                    q.remove(ticket)
+                    if not q: del self._queues[session]
+                self.counters["timeouts"] += 1
+                raise SchedulerTimeout(f"kein Slot nach {timeout:.1f} s")
+            wait = time.monotonic() - t0
+            self._waits.append(wait)
+            return wait
+
+    def release(self):
+        with self._lock:
+            self._active -= 1
+            self._dispatch()
+
+    def note_retry(self):
+        with self._lock: self.counters["retries"] += 1
+
+    def pause(self, seconds):
+        """Vergabe global für `seconds` anhalten (Retry-After eines 429)."""
+        with self._lock:
+            self.counters["rate_limited"] += 1
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def _dispatch(self):
+        # nur mit gehaltenem Lock aufrufen
+        now = time.monotonic()
+        if now < self._paused_until:
+            if self._timer is None:
+                self._timer = threading.Timer(self._paused_until - now, self._resume)
+                self._timer.daemon = True
+                self._timer.start()
+            return
+        while self._active < self.max_concurrent and self._queues:
+            session, q = next(iter(self._queues.items()))
+            ticket = q.popleft()
+            if q: self._queues.move_to_end(session)
+            else: del self._queues[session]
+            self._active += 1
+            self.counters["granted"] += 1
+            ticket["granted"] = True
+            ticket["event"].set()
+
+    def _resume(self):
+        with self._lock:
+            self._timer = None
+            self._dispatch()
+
+    def stats(self):
+        with self._lock:
+            s = dict(self.counters)
+            s["active"] = self._active
+            s["queued"] = sum(len(q) for q in self._queues.values())
+            waits = sorted(self._waits)
+        s["wait_ms_avg"] = 1000 * sum(waits) / len(waits) if waits else 0.0
+        s["wait_ms_p95"] = 1000 * waits[min(len(waits) - 1, int(0.95 * len(waits)))] if waits else 0.0
+        s["wait_ms_max"] = 1000 * waits[-1] if waits else 0.0
+        return s
+
+_scheduler = None
+
+def scheduler():
+    global _scheduler
+    with _client_lock:
+        if _scheduler is None: _scheduler = RequestScheduler()
+        return _scheduler
+
+def _retry_delay(exc, attempt):
+    """Wartezeit vor dem nächsten Versuch oder None (nicht wiederholbar).
+
+    429/5xx/Timeouts werden wiederholt: Retry-After des Providers, sonst exponentieller
+    Backoff – jeweils mit Jitter, damit nicht alle Sessions gleichzeitig zurückkommen.
+    """
+    status = getattr(exc, "status_code", None)
+    name = type(exc).__name__
+    if not (status in (429, 500, 502, 503, 504) or name in ("APITimeoutError", "APIConnectionError")):
+        return None
+    retry_after = None
+    headers = getattr(getattr(exc, "response", None), "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"): retry_after = float(headers["retry-after-ms"]) / 1000
+        elif headers.get("retry-after"): retry_after = float(headers["retry-after"])
+    except (TypeError, ValueError):
+        retry_after = None
+    backoff = LLM_BACKOFF_BASE_S * (2 ** attempt) * random.uniform(0.5, 1.5)
+    if retry_after is not None:
+        return retry_after + random.uniform(0, 0.25 * max(retry_after, LLM_BACKOFF_BASE_S))
+    return backoff
+
+# ============== Circuit Breaker ==============
+class CircuitBreaker:
+    """Gemeinsamer Schalter für alle Sessions: closed -> open -> half_open -> closed.
+
+    Nach `failures` Fehlern/Timeouts in Folge öffnet er; `allow()` ist dann für
+    `cooldown_s` False (Aufrufer nimmt sofort Regel-Text statt die Fehlerlatenz zu
+    zahlen). Danach lässt er genau einen Probe-Aufruf durch: Erfolg schließt, Fehler
+    öffnet erneut; kam die Probe nie beim Provider an (lokale Queue), gibt `record_skipped()`
+    sie wieder frei. Jeder Zustandswechsel geht an `on_change(prev, new, failures, reason)`.
+    """
+    def __init__(self, failures=LLM_BREAKER_FAILURES, cooldown_s=LLM_BREAKER_COOLDOWN_S):
+        self.failures = failures
+        self.cooldown_s = cooldown_s
+        self.on_change = None
+        self.state = "closed"
+        self._lock = threading.Lock()
+        self._consecutive = 0
+        self._opened_at = 0.0
+        self._probe_out = False
+        self.counters = dict(opened=0, short_circuited=0, probes=0)
+
+    def allow(self):
+        with self._lock:
+            if self.state == "closed": return True
+            if self.state == "open" and time.monotonic() - self._opened_at >= self.cooldown_s:
+                self._set("half_open", "cooldown")
+            if self.state == "half_open" and not self._probe_out:
+                self._probe_out = True; self.counters["probes"] += 1
+                return True
+            self.counters["short_circuited"] += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._consecutive = 0
+            if self.state != "closed": self._set("closed", "probe ok")
+
+    def record_skipped(self):
+        # weder Erfolg noch Fehler: Anfrage hat den Provider nie erreicht
+        with self._lock:
+            if self.state == "half_open": self._probe_out = False
+
+    def record_failure(self, reason=""):
+        with self._lock:
+            self._consecutive += 1
+            if self.state == "half_open" or (self.state == "closed" and self._consecutive >= self.failures):
+                self._opened_at = time.monotonic()
+                self.counters["opened"] += 1
+                self._set("open", reason)
+
+    def _set(self, new, reason):
+        # nur mit gehaltenem Lock aufrufen
+        prev, self.state = self.state, new
+        self._probe_out = False
+        cb = self.on_change
+        if cb is not None:
+            try: cb(prev, new, self._consecutive, reason)
+            except Exception: pass
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters, state=self.state, consecutive_failures=self._consecutive)
+
+_breaker = None
+
+def breaker():
+    global _breaker
+    with _client_lock:
+        if _breaker is None: _breaker = CircuitBreaker()
+        return _breaker
+
+# ============== Hedging ==============
+class HedgePolicy:
+    """Adaptive Schwelle + Kostendeckel für Hedge-Anfragen.
+
+    Die Schwelle ist das `percentile` der letzten Zeiten bis zum ersten Token
+    (mindestens `min_s`; solange unter 20 Messwerte vorliegen: halbes Budget).
+    Gehedgt wird höchstens bei `max_ratio` aller Antworten – mehr zusätzliche
+    API-Kosten kann der Modus nicht verursachen.
+    """
+    def __init__(self, percentile=LLM_HEDGE_PERCENTILE, max_ratio=LLM_HEDGE_MAX_RATIO, min_s=LLM_HEDGE_MIN_S):
+        self.percentile = percentile
+        self.max_ratio = max_ratio
+        self.min_s = min_s
+        self._lock = threading.Lock()
+        self._ttft = deque(maxlen=500)
+        self.counters = dict(calls=0, hedged=0, hedge_wins=0, capped=0)
+
+    def note_call(self):
+        with self._lock: self.counters["calls"] += 1
+
+    def note_ttft(self, seconds):
+        with self._lock: self._ttft.append(seconds)
+
+    def note_win(self):
+        with self._lock: self.counters["hedge_wins"] += 1
+
+    def threshold(self, budget_s):
+        with self._lock: samples = sorted(self._ttft)
+        if len(samples) < 20: return max(self.min_s, budget_s / 2)
+        return max(self.min_s, samples[min(len(samples) - 1, int(self.percentile * len(samples)))])
+
+    def try_hedge(self):
+        with self._lock:
+            c = self.counters
+            if c["hedged"] + 1 > self.max_ratio * c["calls"]:
+                c["capped"] += 1; return False
+            c["hedged"] += 1; return True
+
+    def stats(self):
+        with self._lock:
+            s = dict(self.counters)
+        s["hedge_rate"] = s["hedged"] / s["calls"] if s["calls"] else 0.0
+        s["win_rate"] = s["hedge_wins"] / s["hedged"] if s["hedged"] else 0.0
+        return s
+
+_hedge_policy = None
+
+def hedge_policy():
+    global _hedge_policy
+    with _client_lock:
+        if _hedge_policy is None: _hedge_policy = HedgePolicy()
+        return _hedge_policy
+
+# ============== Latenzbudget (Zähler für StreamingReply) ==============
+_executor = None
+_budget_lock = threading.Lock()
+_budget_stats = {}      # condition -> {"calls", "overruns", "late_used", "late_discarded"}
+
+def _pool():
+    global _executor
+    with _budget_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=LLM_WORKERS, thread_name_prefix="llm")
+        return _executor
+
+def _count(tag, field):
+    with _budget_lock:
+        s = _budget_stats.setdefault(tag, dict(calls=0, overruns=0, late_used=0, late_discarded=0))
+        s[field] += 1
+
+def budget_stats():
+    with _budget_lock:
+        return {k: dict(v) for k, v in _budget_stats.items()}
+
+# ============== Streaming ==============
+class StreamAborted(Exception):
+    """Stream lieferte kein erstes Token im Budget oder brach mit Fehler ab."""
+
+_DONE = object()
+_SENT = object()        # erste Anfrage hat einen Scheduler-Slot -> ab jetzt läuft das Budget
+
+class StreamingReply:
+    """Live-Antwort, die beim Anlegen sofort im Hintergrund startet.
+
+    Ein Worker-Thread liest den API-Stream (bzw. mit `stream=False` die ganze Antwort
+    als ein Stück) in eine Queue; `deltas()` liefert die Stücke an den Script-Thread.
+    Das Budget zählt ab dem Versand an den Provider (mit `stream=False` also für die ganze
+    Antwort); die Wartezeit im RequestScheduler zählt nicht mit, sonst fiele bei einem
+    Ansturm gerade die Bedingung mit mehr LLM-Zügen öfter auf Regel-Text zurück. Bekommt die
+    Anfrage keinen Slot (LLM_QUEUE_TIMEOUT_S), ist der Rückfallgrund `queue_wait`.
+    Kommt das erste Stück nicht im Budget, stockt der Stream danach länger als
+    LLM_TOKEN_GAP_S zwischen zwei Stücken oder bricht er ab, wirft `deltas()`
+    StreamAborted – der Aufrufer zeigt dann `fallback` (Regel-Text). Eine verspätete, aber vollständige
+    Antwort geht an `on_late`, eine erfolgreiche an `on_complete`. Den Circuit Breaker
+    bedient der Worker mit dem echten Ergebnis der Anfrage (auch wenn es zu spät kommt);
+    nur ein Stocken nach dem ersten Stück meldet `deltas()` selbst als Fehler.
+
+    Mit `hedge=True` startet nach `hedge_policy().threshold()` ohne erstes Stück eine
+    zweite identische Anfrage; wer zuerst liefert, gewinnt, der Verlierer-Stream wird
+    geschlossen (ohne Streaming wird die Verlierer-Antwort nur verworfen).
+
+    Mit `guard` (OutputGuard) läuft jedes Stück vor der Anzeige durch die Preisprüfung;
+    ein Verstoß schließt den Stream sofort und endet wie ein Abbruch (Regel-Text).
+    Nach `deltas()` stehen Zeiten, Tokens und ggf. `fallback_reason` in `metrics()`.
+    """
+    def __init__(self, system, user, fallback, temperature=0.6, max_tokens=120, budget_s=None,
+                 tag="all", on_complete=None, on_late=None, stream=True, session="-", hedge=None, guard=None,
+                 phase="-"):
+        self.fallback = fallback
+        self.session = session
+        self.queue_wait_s = 0.0               # Wartezeit im RequestScheduler (Summe über Versuche)
+        self.budget_s = LLM_BUDGET_S if budget_s is None else budget_s
+        self.tag = tag
+        self.on_complete = on_complete
+        self.on_late = on_late
+        self.text = ""
+        self.phase = phase
+        self.usage = {}                      # prompt_tokens, completion_tokens, model (der Gewinner-Anfrage)
+        self.ttft_s = None                   # aus Sicht des Aufrufers: Anlegen -> erstes Stück
+        self.wall_s = None                   # Anlegen -> Ende bzw. Abbruch
+        self.fallback_reason = ""
+        self._q = queue.Queue()
+        self._ready = threading.Event()      # erstes Stück (oder Fehler/Ende) liegt vor
+        self._abandoned = False
+        self._reported = False               # Ergebnis schon an den CircuitBreaker gemeldet
+        self._lock = threading.Lock()
+        self._winner = None                  # 0 = erste Anfrage, 1 = Hedge
+        self._live = 1                       # laufende Anfragen (für Fehler beim Hedging)
+        self._handles = {}                   # aid -> chat_stream-Handle (Verlierer wird geschlossen)
+        self.hedged = False
+        self.guard = guard
+        if guard is not None: _count_guard(guard.phase, "checked")
+        self._t0 = time.monotonic()
+        self._sent_at = None                 # Versand der ersten Anfrage (Start des Budgets)
+        self._sent = threading.Event()
+        _count(tag, "calls")
+        args = (system, user, temperature, max_tokens, stream)
+        self._fut = _pool().submit(self._pump, *args)
+        if LLM_HEDGE if hedge is None else hedge:
+            hedge_policy().note_call()
+            _pool().submit(self._hedge_after, args)
+
+    def _put(self, item):
+        self._q.put(item); self._ready.set()
+
+    def _report(self, ok, reason=""):
+        # einmal pro Antwort und nur für Anfragen, die beim Provider waren: zuerst gemeldetes
+        # Ergebnis zählt (Stocken vor später Antwort); ok=None = nie versandt (lokale Queue)
+        with self._lock:
+            if self._reported: return
+            self._reported = True
+        if ok is None: breaker().record_skipped()
+        elif ok: breaker().record_success()
+        else: breaker().record_failure(reason)
+
+    def _claim(self, aid):
+        # erstes Stück entscheidet, welche Anfrage (0/1) die Queue beliefern darf; die andere
+        # wird sofort geschlossen und gibt HTTP-Verbindung und Scheduler-Platz frei
+        with self._lock:
+            first = self._winner is None
+            if first:
+                self._winner = aid
+                hedge_policy().note_ttft(time.monotonic() - (self._sent_at or self._t0))
+                if aid == 1: hedge_policy().note_win()
+            won = self._winner == aid
+            loser = self._handles.get(1 - aid) if first and self.hedged else None
+        if loser is not None: cancel_stream(loser)
+        return won
+
+    def _fail(self, aid, exc, reason, upstream=True):
+        with self._lock:
+            self._live -= 1
+            # die andere Anfrage läuft noch (bzw. hat schon gewonnen) -> Fehler still schlucken
+            if self._winner not in (None, aid) or (self._winner is None and self._live > 0): return
+        self._report(False if upstream else None, reason); self._put(exc)
+
+    def _mark_sent(self):
+        with self._lock:
+            if self._sent_at is not None: return
+            self._sent_at = time.monotonic()
+        self._sent.set(); self._q.put(_SENT)
+
+    def _hedge_after(self, args):
+        threshold = hedge_policy().threshold(self.budget_s)
+        if not self._sent.wait(LLM_QUEUE_TIMEOUT_S): return  # nie versandt -> nichts zu hedgen
+        if threshold >= self._budget_left(): return          # käme ohnehin zu spät
+        if self._ready.wait(threshold): return
+        with self._lock:
+            if self._winner is not None or self._abandoned or self._reported: return
+            if breaker().state != "closed" or not hedge_policy().try_hedge(): return
+            self._live += 1; self.hedged = True
+        self._pump(*args, aid=1)
+
+    def _pump(self, system, user, temperature, max_tokens, stream, aid=0):
+        sched = scheduler()
+        guard = self.guard
+        parts = []
+        err = None
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            if self._winner not in (None, aid): return           # die andere Anfrage war schneller
+            if self._abandoned and self.on_late is None:          # niemand wartet mehr
+                if err is not None: self._fail(aid, err, type(err).__name__)   # Fehlversuch zählt
+                else: self._fail(aid, StreamAborted("abandoned"), "abandoned", upstream=False)
+                return
+            try:
+                self.queue_wait_s += sched.acquire(self.session)
+            except SchedulerTimeout as e:
+                # nie beim Provider -> für den Circuit Breaker weder Erfolg noch Fehler
+                if err is not None: self._fail(aid, err, type(err).__name__)
+                else: self._fail(aid, e, "queue_wait", upstream=False)
+                return
+            delay = None
+            usage = {}
+            try:
+                if self._winner not in (None, aid): return       # während des Wartens verloren
+                self._mark_sent()
+                if stream:
+                    with self._lock: handle = self._handles[aid] = {}
+                    gen = chat_stream(system, user, temperature, max_tokens, usage=usage, handle=handle)
+                    try:
+                        for delta in gen:
+                            if not self._claim(aid): return       # verloren -> Stream schließen
+                            if guard is not None: delta = guard.feed(delta)
+                            if delta: parts.append(delta); self._put(delta)
+                    finally:
+                        gen.close()
+                    if self._winner not in (None, aid): return   # vom Gewinner geschlossen
+                else:
+                    text = _chat_raw(system, user, temperature, max_tokens, usage=usage)
+                    if not text: raise RuntimeError("leere Antwort")
+                    if not self._claim(aid): return
+                    if guard is not None: text = guard.feed(text)
+                    parts.append(text); self._put(text)
+                if guard is not None:
+                    tail = guard.finish()
+                    if tail: parts.append(tail); self._put(tail)
+                self.usage.update(usage)
+                break
+            except GuardViolation as e:
+                # API lief einwandfrei -> für den Circuit Breaker ein Erfolg
+                _count_guard(guard.phase, e.reason)
+                self._report(True); self._put(e); return
+            except Exception as e:
+                delay = _retry_delay(e, attempt)
+                if delay is None or parts or (guard is not None and guard.text) or attempt == LLM_MAX_RETRIES:
+                    self._fail(aid, e, type(e).__name__); return
+                err = e
+                if getattr(e, "status_code", None) == 429: sched.pause(delay)
+            finally:
+                sched.release()
+            sched.note_retry()
+            time.sleep(delay)
+        self._report(True)
+        self._put(_DONE)
+        if self._abandoned:
+            text = "".join(parts).strip()
+            if text and self.on_late is not None:
+                try: self.on_late(text); _count(self.tag, "late_used")
+                except Exception: _count(self.tag, "late_discarded")
+            else:
+                _count(self.tag, "late_discarded")
+
+    def _budget_left(self):
+        t = self._sent_at
+        return self.budget_s if t is None else max(0.0, self.budget_s - (time.monotonic() - t))
+
+    def deltas(self):
+        # bis zum Versand höchstens so lange wie der Scheduler (danach kommt SchedulerTimeout)
+        timeout = self._budget_left() if self._sent_at is not None else LLM_QUEUE_TIMEOUT_S + 1.0
+        while True:
+            try: item = self._q.get(timeout=timeout)
+            except queue.Empty:
+                # vor dem Versand: Queue; vor dem ersten Stück: Budget überschritten; danach: Stream stockt
+                reason = "stall" if self.text else "timeout" if self._sent_at is not None else "queue_wait"
+                self._abandoned = True
+                if reason == "timeout": _count(self.tag, "overruns")
+                else: self._report(False, reason)       # Timeout: der Worker meldet das Ergebnis
+                self._end(reason)
+                raise StreamAborted(reason)
+            if item is _SENT:
+                if not self.text: timeout = self._budget_left()
+                continue
+            if item is _DONE: break
+            if isinstance(item, Exception):
+                self._end(_fallback_reason(item))
+                raise StreamAborted(repr(item))
+            if self.ttft_s is None: self.ttft_s = time.monotonic() - self._t0
+            self.text += item
+            timeout = LLM_TOKEN_GAP_S
+            try: yield item
+            except GeneratorExit: self.abandon(); raise     # Aufrufer bricht ab (z. B. Streamlit-Rerun)
+        self._end("")
+        self.text = self.text.strip()
+        if self.text and self.on_complete is not None: self.on_complete(self.text)
+
+    def abandon(self, reason="interrupted"):
+        """Aufrufer liest nicht weiter: späte Antwort geht an `on_late`, `metrics()` nennt `reason`."""
+        if self.wall_s is not None: return
+        self._abandoned = True
+        self._end(reason)
+
+    def _end(self, reason):
+        self.wall_s = time.monotonic() - self._t0
+        self.fallback_reason = reason
+
+    def metrics(self):
+        return dict(phase=self.phase, fallback_reason=self.fallback_reason,
+                    model=self.usage.get("model") or OPENAI_MODEL,
+                    wall_s=self.wall_s, ttft_s=self.ttft_s, queue_wait_s=self.queue_wait_s,
+                    prompt_tokens=self.usage.get("prompt_tokens"), cached_tokens=self.usage.get("cached_tokens"),
+                    completion_tokens=self.usage.get("completion_tokens"), hedged=self.hedged)
+
+def _fallback_reason(exc):
+    if isinstance(exc, GuardViolation): return f"guard:{exc.reason}"
+    if isinstance(exc, SchedulerTimeout): return "queue_wait"
+    return f"error:{type(exc).__name__}"
+
+# ============== Rhetorik-Cache (LRU + TTL) ==============
+def situation_key(condition, phase, bot_offer, arg_flags=(), hint=""):
+    """Normalisierte Situation: Bedingung, Phase, Angebot (5-€-Raster), aktive Argumente, Zusatz."""
+    offer = int(round(bot_offer / 5) * 5) if bot_offer is not None else None
+    return "|".join([condition, phase, str(offer), ",".join(sorted(arg_flags)), hint or ""])
+
+class RhetoricCache:
+    """Bis zu `max_variants` generierte Sätze pro Situation, LRU über Keys, TTL pro Variante.
+
+    `get()` liefert erst einen Treffer, wenn der Key voll ist – bis dahin wird weiter
+    generiert, damit genug Abwechslung entsteht. Texte aus `avoid` (bereits im Chat)
+    werden nicht erneut ausgespielt.
+    """
+    def __init__(self, max_keys=LLM_CACHE_KEYS, max_variants=LLM_CACHE_VARIANTS, ttl_s=LLM_CACHE_TTL_S, path=None):
+        self.max_keys = max_keys
+        self.max_variants = max_variants
+        self.ttl_s = ttl_s
+        self.path = Path(path) if path else None
+        self._data = OrderedDict()          # key -> [(text, created_epoch), ...]
+        self._lock = threading.Lock()
+        self._dirty = 0
+        self.counters = dict(hits=0, misses=0, puts=0, evictions=0, expired=0)
+        if self.path: self.load()
+
+    def _fresh(self, key, now):
+        variants = self._data.get(key)
+        if not variants: return []
+        alive = [(t, ts) for t, ts in variants if now - ts < self.ttl_s]
+        if len(alive) != len(variants):
+            self.counters["expired"] += len(variants) - len(alive)
+            if alive: self._data[key] = alive
+            else: del self._data[key]
+        return alive
+
+    def get(self, key, avoid=()):
+        now = time.time()
+        with self._lock:
+            alive = self._fresh(key, now)
+            candidates = [t for t, _ in alive if t not in avoid]
+            if len(alive) < self.max_variants or not candidates:
+                self.counters["misses"] += 1
+                return None
+            self._data.move_to_end(key)
+            self.counters["hits"] += 1
+            return random.choice(candidates)
+
+    def put(self, key, text):
+        now = time.time()
+        with self._lock:
+            alive = self._fresh(key, now)
+            if any(t == text for t, _ in alive): return
+            alive.append((text, now))
+            self._data[key] = alive[-self.max_variants:]
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_keys:
+                self._data.popitem(last=False); self.counters["evictions"] += 1
+            self.counters["puts"] += 1
+            self._dirty += 1
+            save_now = self.path is not None and self._dirty >= 20
+        if save_now: self.save()
+
+    def stats(self):
+        with self._lock:
+            s = dict(self.counters)
+            s["keys"] = len(self._data)
+            s["variants"] = sum(len(v) for v in self._data.values())
+        lookups = s["hits"] + s["misses"]
+        s["hit_rate"] = s["hits"] / lookups if lookups else 0.0
+        return s
+
+    # --- Persistenz ---
+    def save(self):
+        if not self.path: return
+        with self._lock:
+            snapshot = {k: v for k, v in self._data.items()}
+            self._dirty = 0
+        tmp = self.path.with_suffix(self.path.suffix + ".tmp")
+        tmp.write_text(json.dumps(snapshot, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp, self.path)
+
+    def load(self):
+        if not self.path or not self.path.exists(): return
+        try: raw = json.loads(self.path.read_text(encoding="utf-8"))
+        except (OSError, ValueError): return
+        now = time.time()
+        with self._lock:
+            for key, variants in raw.items():
+                alive = [(t, ts) for t, ts in variants if now - ts < self.ttl_s]
+                if alive: self._data[key] = alive[-self.max_variants:]
+            while len(self._data) > self.max_keys: self._data.popitem(last=False)
+
+_cache = None
+
+def rhetoric_cache():
+    """Prozessweiter RhetoricCache (persistiert nach LLM_CACHE_PATH, falls gesetzt)."""
+    global _cache
+    with _client_lock:
+        if _cache is None:
+            _cache = RhetoricCache(path=LLM_CACHE_PATH)
+            if LLM_CACHE_PATH: atexit.register(_cache.save)
+        return _cache
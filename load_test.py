@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+# =============================================================================
+# Lasttest für den LLM-Pfad der Hybrid-App ("app.py AI 2.0.py")
+# - N gleichzeitige simulierte Sessions, je M Bot-Züge über typische Phasen
+# - jeder Zug läuft wie der LLM-Zweig von _compose_text/_llm_generate:
+#   Cache -> Circuit Breaker -> StreamingReply (Budget, Scheduler, Hedging, Guard)
+#   -> Regel-Text als Rückfall (die Tipp-Verzögerung läuft im Browser und fehlt hier)
+# - ohne --base-url startet der Mock (mock_llm_server.py) im selben Prozess,
+#   es fallen also keine API-Kosten an
+# - Bericht: Durchsatz, p50/p95/p99 (Antwort und erstes Token), Rückfallquote
+#   nach Grund, Scheduler-/Breaker-/Hedge-/Guard-Zähler
+#
+# Aufruf:  python load_test.py --sessions 50 --turns 6 [--latency lognormal:0.6,0.5]
+#                              [--error-rate 0.05] [--budget 1.5] [--hedge] [--json]
+#          python load_test.py --base-url http://127.0.0.1:8001/v1   (externer Mock)
+# =============================================================================
+
+import argparse
+import json
+import os
+import random
+import threading
+import time
+from collections import Counter
+
+import mock_llm_server
+
+ORIGINAL_PRICE = 1000
+# (Nutzerangebot, Phase, Gegenangebot) – grob der Verlauf einer Verhandlung
+SCRIPT = [(350, "tier1_lowball", 985), (450, "tier2_lowball", 975), (600, "tier3_lowball", 965),
+          (800, "mid_low", 950), (None, "no_price", 950), (880, "late_near_floor", 930),
+          (890, "late_subfloor_rare", 895), (1000, "at_or_above_list", 1000)]
+ARG = "Es ist neu & originalverpackt – ohne Nutzungsspuren."
+
+def _pct(values, p):
+    if not values: return None
+    v = sorted(values)
+    return v[min(len(v) - 1, int(p * len(v)))]
+
+def run_turn(llm_client, session, cond, u_offer, phase, bot_offer, use_cache):
+    """Ein Bot-Zug; liefert (Ergebnis, Antwortzeit s, Zeit bis erstes Stück s)."""
+    t0 = time.monotonic()
+    extra = llm_client.rebuke_hint(cond, u_offer)
+    fallback = f"Gegenangebot: {bot_offer} €."
+    cache = llm_client.rhetoric_cache()
+    key = llm_client.situation_key(cond, phase, bot_offer, ("new",), extra)
+    if use_cache and cache.get(key) is not None:
+        return "cache", time.monotonic() - t0, time.monotonic() - t0
+    if not llm_client.breaker().allow():
+        return "breaker", time.monotonic() - t0, time.monotonic() - t0
+    system, user = llm_client.prompts(cond, bot_offer, phase, ARG, extra, ORIGINAL_PRICE)
+    reply = llm_client.StreamingReply(
+        system, user, fallback, temperature=0.6 if cond == "neutral" else 0.7, max_tokens=120, tag=cond,
+        stream=llm_client.LLM_STREAM, on_complete=lambda t: cache.put(key, t),
+        on_late=lambda t: cache.put(key, t), session=session,
+        guard=llm_client.OutputGuard(bot_offer, phase, ORIGINAL_PRICE), phase=phase)
+    ttft = None
+    try:
+        for _ in reply.deltas():
+            if ttft is None: ttft = time.monotonic() - t0
+        outcome = "llm"
+    except llm_client.StreamAborted as e:
+        msg = str(e)
+        outcome = msg if msg in ("timeout", "stall", "queue_wait") else "guard" if msg.startswith("GuardViolation") \
+            else "queue_wait" if msg.startswith("SchedulerTimeout") else "error"
+    elapsed = time.monotonic() - t0
+    m = reply.metrics()
+    llm_client.call_metrics().add(phase, "llm", m["fallback_reason"], m["wall_s"], m["ttft_s"],
+                                  m["prompt_tokens"], m["completion_tokens"], m["cached_tokens"])
+    return outcome, elapsed, ttft if ttft is not None else elapsed
+
+def run(args):
+    # Konfiguration vor dem Import von llm_client setzen (liest Umgebung beim Import)
+    server = None
+    if args.base_url:
+        base_url = args.base_url
+    else:
+        server, base_url = mock_llm_server.serve_in_thread(mock_llm_server.config_from_args(args))
+    os.environ["OPENAI_BASE_URL"] = base_url
+    os.environ.setdefault("OPENAI_API_KEY", "mock")
+    os.environ["LLM_BUDGET_S"] = str(args.budget)
+    os.environ["LLM_STREAM"] = "1" if args.stream else "0"
+    os.environ["LLM_HEDGE"] = "1" if args.hedge else "0"
+    if args.max_concurrent: os.environ["LLM_MAX_CONCURRENT"] = str(args.max_concurrent)
+    import llm_client
+
+    results = []
+    lock = threading.Lock()
+    def session(i):
+        sid = f"load_{i:04d}"
+        cond = ("neutral", "power")[i % 2]
+        for t in range(args.turns):
+            u, phase, offer = SCRIPT[t % len(SCRIPT)]
+            r = run_turn(llm_client, sid, cond, u, phase, offer, args.cache)
+            with lock: results.append((cond, phase) + r)
+            if args.think: time.sleep(random.uniform(0, args.think))
+
+    llm_client.warm_up()
+    t0 = time.monotonic()
+    threads = [threading.Thread(target=session, args=(i,), daemon=True) for i in range(args.sessions)]
+    for th in threads: th.start()
+    for th in threads: th.join()
+    wall = time.monotonic() - t0
+
+    outcomes = Counter(r[2] for r in results)
+    lat = [r[3] for r in results]
+    ttft = [r[4] for r in results if r[2] == "llm"]
+    fallback = sum(n for k, n in outcomes.items() if k not in ("llm", "cache"))
+    report = {
+        "sessions": args.sessions, "turns": len(results), "wall_s": wall,
+        "throughput_turns_per_s": len(results) / wall if wall else None,
+        "latency_s": {"p50": _pct(lat, 0.50), "p95": _pct(lat, 0.95), "p99": _pct(lat, 0.99), "max": max(lat, default=None)},
+        "ttft_s": {"p50": _pct(ttft, 0.50), "p95": _pct(ttft, 0.95), "p99": _pct(ttft, 0.99)},
+        "fallback_rate": fallback / len(results) if results else None,
+        "outcomes": dict(outcomes.most_common()),
+        "scheduler": llm_client.scheduler().stats(),
+        "breaker": llm_client.breaker().stats(),
+        "hedge": llm_client.hedge_policy().stats() if args.hedge else None,
+        "guard": llm_client.guard_stats(),
+        "tokens": {k: llm_client.call_metrics().stats()[k] for k in ("prompt_tokens", "cached_tokens", "completion_tokens")},
+        "mock": server.RequestHandlerClass.cfg.stats() if server else None,
+    }
+    if server: server.shutdown()
+    return report
+
+def print_report(r):
+    f = lambda x: "–" if x is None else f"{x * 1000:.0f} ms"
+    print(f"{r['sessions']} Sessions, {r['turns']} Züge in {r['wall_s']:.1f} s "
+          f"-> {r['throughput_turns_per_s']:.1f} Züge/s")
+    l, t = r["latency_s"], r["ttft_s"]
+    print(f"Antwortzeit: p50 {f(l['p50'])}  p95 {f(l['p95'])}  p99 {f(l['p99'])}  max {f(l['max'])}")
+    print(f"Erstes Token (LLM): p50 {f(t['p50'])}  p95 {f(t['p95'])}  p99 {f(t['p99'])}")
+    print(f"Rückfallquote: {r['fallback_rate']:.1%}  ("
+          + ", ".join(f"{k}={v}" for k, v in r["outcomes"].items()) + ")")
+    s = r["scheduler"]
+    print(f"Scheduler: Wartezeit Ø {s['wait_ms_avg']:.0f} ms / p95 {s['wait_ms_p95']:.0f} ms · "
+          f"429: {s['rate_limited']} · Retries: {s['retries']} · Queue-Timeouts: {s['timeouts']}")
+    b = r["breaker"]
+    print(f"Circuit Breaker: {b['state']} · geöffnet {b['opened']}× · übersprungen {b['short_circuited']}")
+    if r["hedge"]:
+        h = r["hedge"]
+        print(f"Hedging: {h['hedged']}/{h['calls']} ({h['hedge_rate']:.0%}) · gewonnen {h['hedge_wins']}")
+    for ph, g in sorted(r["guard"].items()):
+        v = {k: n for k, n in g.items() if k != "checked"}
+        if v: print(f"Guard {ph}: " + ", ".join(f"{k}={n}" for k, n in sorted(v.items())))
+    tok = r["tokens"]
+    print(f"Tokens: Prompt {tok['prompt_tokens']} (gecacht {tok['cached_tokens']}) + Antwort {tok['completion_tokens']}")
+    if r["mock"]: print("Mock: " + ", ".join(f"{k}={v}" for k, v in r["mock"].items()))
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Lasttest des LLM-Pfads gegen den lokalen Mock (oder --base-url).")
+    ap.add_argument("--sessions", type=int, default=50, help="gleichzeitige Sessions (Standard: 50)")
+    ap.add_argument("--turns", type=int, default=6, help="Bot-Züge pro Session (Standard: 6)")
+    ap.add_argument("--base-url", default=None, help="externer Endpunkt statt eingebautem Mock")
+    ap.add_argument("--budget", type=float, default=1.5, help="LLM_BUDGET_S (Standard: 1.5)")
+    ap.add_argument("--max-concurrent", type=int, default=None, help="LLM_MAX_CONCURRENT")
+    ap.add_argument("--no-stream", dest="stream", action="store_false", help="ohne Token-Streaming")
+    ap.add_argument("--hedge", action="store_true", help="Hedging einschalten (LLM_HEDGE=1)")
+    ap.add_argument("--cache", action="store_true", help="Rhetorik-Cache nutzen (Standard: aus, misst reine LLM-Last)")
+    ap.add_argument("--think", type=float, default=0.0, help="max. Denkpause der Nutzer zwischen Zügen in s")
+    ap.add_argument("--json", action="store_true", help="Ergebnis als JSON ausgeben")
+    mock_llm_server.add_mock_args(ap)
+    args = ap.parse_args(argv)
+
+    report = run(args)
+    if args.json: print(json.dumps(report, ensure_ascii=False, indent=2))
+    else: print_report(report)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,602 @@
+# -*- coding: utf-8 -*-
+# =============================================================================
+# Gemeinsame Logging-Helfer für die Verhandlungs-Apps (ohne Streamlit-Abhängigkeit)
+# - TranscriptBuffer: Transkriptzeilen einer Session gepuffert, Batch-Flush statt
+#   open/append pro Chatnachricht
+# - EventStore: optional EIN append-only Log (JSONL-Segmente, nach Größe gerollt)
+#   mit Offset-Index pro session_id statt einer CSV-Datei pro Teilnehmer
+#   -> Umschalten per LOG_BACKEND=events, Export pro Session per CLI:
+#      python log_store.py export --logs logs --out export/
+# - BackgroundWriter: prozessweiter Schreib-Thread für gemeinsame CSVs
+#   (outcomes.csv, survey.csv) – Sessions reihen nur ein, kein Disk-I/O im Rerun;
+#   Schreibfehler -> Retry mit Backoff, danach spill/<ziel>.jsonl (nie verworfen)
+# - SqliteStore: LOG_BACKEND=sqlite -> logs/negotiation.db (WAL) mit indizierten
+#   Tabellen transcripts/outcomes/survey; CSV-Export fürs bestehende Auswerten:
+#      python log_store.py sqlite-export --logs logs --out export/
+# - Session-Summary: eine Zeile pro Session bei Abschluss (sessions.csv bzw.
+#   Tabelle `sessions`), damit Dashboards keine Transkripte neu parsen müssen
+# =============================================================================
+
+import argparse
+import atexit
+import csv
+import json
+import os
+import queue
+import sqlite3
+import sys
+import threading
+import time
+import weakref
+from pathlib import Path
+
+try:
+    import fcntl                      # Sperre über Prozessgrenzen (nur POSIX)
+except ImportError:
+    fcntl = None
+
+TRANSCRIPT_HEADER = ["timestamp_utc","session_id","condition","role","text","current_offer_eur"]
+
+LOG_BACKEND = os.getenv("LOG_BACKEND", "csv").lower()          # "csv" | "events" | "sqlite"
+SEGMENT_MAX_BYTES = int(os.getenv("LOG_SEGMENT_MAX_BYTES", 64 * 1024 * 1024))
+
+# ============== Event-Store (segmentiertes JSONL + Index) ==============
+class EventStore:
+    """Append-only Log über alle Sessions.
+
+    Segmente `events/segment_000001.jsonl` ... werden ab `segment_max_bytes` gerollt.
+    `events/index.tsv` enthält pro geschriebenem Block: session_id, Segment, Offset, Länge –
+    damit lässt sich eine Session ohne Vollscan lesen.
+
+    Mehrere Prozesse (App-Varianten, zweites `streamlit run`) dürfen dasselbe Verzeichnis
+    beschreiben: Anhängen und Indexzeile laufen unter `flock` auf index.tsv, der Offset
+    kommt aus der aktuellen Dateigröße, ein von anderen gerolltes Segment wird übernommen.
+    Ohne fcntl (Windows) gilt: ein schreibender Prozess pro Verzeichnis. `rebuild_index`
+    nur ohne laufende Schreiber.
+    """
+    def __init__(self, root, segment_max_bytes=SEGMENT_MAX_BYTES):
+        self.root = Path(root); self.root.mkdir(parents=True, exist_ok=True)
+        self.segment_max_bytes = segment_max_bytes
+        self._lock = threading.Lock()
+        self._index = {}                 # session_id -> [(segment, offset, length), ...]
+        self._seg_file = None
+        self._idx_file = None
+        self._load_index()
+        segs = self._segments()
+        self._seg_no = int(segs[-1].stem.split("_")[1]) if segs else 1
+
+    # --- Pfade ---
+    def _segments(self):
+        return sorted(self.root.glob("segment_*.jsonl"))
+    def _segment_path(self, no):
+        return self.root / f"segment_{no:06d}.jsonl"
+    @property
+    def index_path(self):
+        return self.root / "index.tsv"
+
+    # --- Index ---
+    def _load_index(self):
+        self._index.clear()
+        if not self.index_path.exists(): return
+        with self.index_path.open("r", encoding="utf-8") as f:
+            for line in f:
+                parts = line.rstrip("\n").split("\t")
+                if len(parts) != 4: continue      # halb geschriebene Zeile nach Absturz
+                sid, seg, off, ln = parts
+                self._index.setdefault(sid, []).append((seg, int(off), int(ln)))
+
+    def rebuild_index(self):
+        """Index komplett aus den Segmenten neu aufbauen (z. B. nach Absturz)."""
+        with self._lock:
+            self._close_files()
+            entries = []
+            for seg in self._segments():
+                off = 0
+                with seg.open("rb") as f:
+                    for raw in f:
+                        try: sid = json.loads(raw)["session_id"]
+                        except Exception: sid = None
+                        if sid is not None:
+                            if entries and entries[-1][0] == sid and entries[-1][1] == seg.name and entries[-1][2] + entries[-1][3] == off:
+                                entries[-1][3] += len(raw)
+                            else:
+                                entries.append([sid, seg.name, off, len(raw)])
+                        off += len(raw)
+            tmp = self.index_path.with_suffix(".tmp")
+            with tmp.open("w", encoding="utf-8") as f:
+                for sid, seg, off, ln in entries: f.write(f"{sid}\t{seg}\t{off}\t{ln}\n")
+            os.replace(tmp, self.index_path)
+            self._load_index()
+
+    # --- Schreiben ---
+    def _close_files(self):
+        for f in (self._seg_file, self._idx_file):
+            if f is not None: f.close()
+        self._seg_file = self._idx_file = None
+
+    def _open_files(self):
+        if self._seg_file is None:
+            self._seg_file = self._segment_path(self._seg_no).open("ab")
+        if self._idx_file is None:
+            self._idx_file = self.index_path.open("a", encoding="utf-8")
+
+    def append_rows(self, header, rows):
+        """Zeilen (Listen in Reihenfolge von `header`) als JSON-Events anhängen."""
+        by_session = {}
+        for row in rows:
+            rec = dict(zip(header, row))
+            by_session.setdefault(str(rec.get("session_id", "")), []).append(
+                (json.dumps(rec, ensure_ascii=False, default=str) + "\n").encode("utf-8"))
+        with self._lock:
+            self._open_files()
+            if fcntl is not None: fcntl.flock(self._idx_file.fileno(), fcntl.LOCK_EX)
+            try:
+                # ein anderer Prozess kann inzwischen gerollt haben -> jüngstes Segment nehmen
+                while self._segment_path(self._seg_no + 1).exists():
+                    self._seg_file.close(); self._seg_file = None
+                    self._seg_no += 1
+                    self._open_files()
+                for sid, lines in by_session.items():
+                    blob = b"".join(lines)
+                    size = os.fstat(self._seg_file.fileno()).st_size     # Dateiende, auch nach fremden Writes
+                    if size > 0 and size + len(blob) > self.segment_max_bytes:
+                        self._seg_file.close(); self._seg_file = None
+                        self._seg_no += 1
+                        self._open_files()
+                        size = os.fstat(self._seg_file.fileno()).st_size
+                    self._seg_file.write(blob); self._seg_file.flush()
+                    seg = self._segment_path(self._seg_no).name
+                    self._idx_file.write(f"{sid}\t{seg}\t{size}\t{len(blob)}\n"); self._idx_file.flush()
+                    self._index.setdefault(sid, []).append((seg, size, len(blob)))
+            finally:
+                if fcntl is not None: fcntl.flock(self._idx_file.fileno(), fcntl.LOCK_UN)
+
+    def close(self):
+        with self._lock: self._close_files()
+
+    # --- Lesen / Export ---
+    def sessions(self):
+        return list(self._index.keys())
+
+    def iter_session(self, session_id):
+        with self._lock:
+            if self._seg_file is not None: self._seg_file.flush()
+            entries = list(self._index.get(session_id, []))
+        for seg, off, ln in entries:
+            with (self.root / seg).open("rb") as f:
+                f.seek(off)
+                for raw in f.read(ln).splitlines():
+                    if raw: yield json.loads(raw)
+
+    def export_session_csv(self, session_id, out_path):
+        """Session als CSV im alten Layout (transcript_<id>.csv) schreiben."""
+        recs = list(self.iter_session(session_id))
+        if not recs: return 0
+        out_path = Path(out_path)
+        with out_path.open("w", newline="", encoding="utf-8") as f:
+            w = csv.DictWriter(f, fieldnames=list(recs[0].keys()), extrasaction="ignore")
+            w.writeheader(); w.writerows(recs)
+        return len(recs)
+
+_STORES = {}
+_STORES_LOCK = threading.Lock()
+
+def event_store(log_dir):
+    """Prozessweiter EventStore unter `<log_dir>/events` (einmal pro Verzeichnis)."""
+    root = (Path(log_dir) / "events").resolve()
+    with _STORES_LOCK:
+        if root not in _STORES: _STORES[root] = EventStore(root)
+        return _STORES[root]
+
+# ============== SQLite-Store (WAL) ==============
+SQLITE_SCHEMA = {
+    "transcripts": ["timestamp_utc","session_id","condition","role","text","current_offer_eur"],
+    "outcomes": ["timestamp_utc","session_id","condition","item","original_price_eur","final_price_eur",
+                 "ended_by","user_turns","duration_seconds"],
+    "survey": ["timestamp_utc","session_id","condition","final_price_eur","ended_by","dominance","pressure",
+               "fairness","satisfaction","trust","expertise","recommend","manipulation_power","comment"],
+    "sessions": ["timestamp_utc","session_id","condition","ended_by","final_price_eur","first_user_offer_eur",
+                 "best_user_offer_eur","last_bot_offer_eur","numeric_rounds","user_turns","bot_turns",
+                 "max_lowball_streak","nag_stage","phases_visited","duration_seconds"],
+    "llm_breaker": ["timestamp_utc","event","session_id","from_state","to_state","consecutive_failures","reason"],
+    "llm_calls": ["timestamp_utc","session_id","condition","phase","source","fallback_reason","model",
+                  "wall_ms","ttft_ms","queue_wait_ms","prompt_tokens","cached_tokens","completion_tokens","hedged"],
+}
+SESSION_HEADER = SQLITE_SCHEMA["sessions"]
+BREAKER_HEADER = SQLITE_SCHEMA["llm_breaker"]
+LLM_CALL_HEADER = SQLITE_SCHEMA["llm_calls"]
+SQLITE_INT_COLS = {"current_offer_eur","original_price_eur","final_price_eur","user_turns","duration_seconds",
+                   "dominance","pressure","fairness","satisfaction","trust","expertise","recommend","manipulation_power",
+                   "first_user_offer_eur","best_user_offer_eur","last_bot_offer_eur","numeric_rounds","bot_turns",
+                   "max_lowball_streak","nag_stage","consecutive_failures","wall_ms","ttft_ms","queue_wait_ms",
+                   "prompt_tokens","cached_tokens","completion_tokens","hedged"}
+SQLITE_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS ix_tr_session ON transcripts(session_id, timestamp_utc)",
+    "CREATE INDEX IF NOT EXISTS ix_tr_cond_ts ON transcripts(condition, timestamp_utc)",
+    "CREATE INDEX IF NOT EXISTS ix_out_session ON outcomes(session_id)",
+    "CREATE INDEX IF NOT EXISTS ix_out_cond_ts ON outcomes(condition, timestamp_utc)",
+    "CREATE INDEX IF NOT EXISTS ix_sv_session ON survey(session_id)",
+    "CREATE INDEX IF NOT EXISTS ix_sv_cond_ts ON survey(condition, timestamp_utc)",
+    "CREATE INDEX IF NOT EXISTS ix_sess_session ON sessions(session_id)",
+    "CREATE INDEX IF NOT EXISTS ix_sess_cond_end ON sessions(condition, ended_by)",
+    "CREATE INDEX IF NOT EXISTS ix_calls_session ON llm_calls(session_id, phase)",
+]
+# abweichende Spaltennamen älterer Varianten (z. B. _log_line in "app.y n.py")
+SQLITE_ALIASES = {"ts_utc":"timestamp_utc","bot_offer":"current_offer_eur","list_price":"original_price_eur",
+                  "final_price":"final_price_eur","duration_s":"duration_seconds","competence":"expertise"}
+
+class SqliteStore:
+    """Eine SQLite-Datei im WAL-Modus für Transkripte, Outcomes und Survey.
+
+    Eine Verbindung pro Prozess (mit Lock); Inserts laufen gebündelt per executemany
+    in einer Transaktion, dadurch atomar auch bei vielen parallelen Sessions.
+    """
+    def __init__(self, path):
+        self.path = Path(path); self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._tables = {}
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        for table, cols in SQLITE_SCHEMA.items():
+            col_sql = ", ".join(f"{c} {'INTEGER' if c in SQLITE_INT_COLS else 'TEXT'}" for c in cols)
+            self._conn.execute(f"CREATE TABLE IF NOT EXISTS {table} (id INTEGER PRIMARY KEY, {col_sql})")
+        for ddl in SQLITE_INDEXES: self._conn.execute(ddl)
+
+    def table(self, name):
+        if name not in SQLITE_SCHEMA: raise ValueError(f"unbekannte Tabelle: {name}")
+        if name not in self._tables: self._tables[name] = _SqliteTable(self, name)
+        return self._tables[name]
+
+    def insert_rows(self, table, header, rows):
+        cols = [SQLITE_ALIASES.get(h, h) for h in header]
+        unknown = [c for c in cols if c not in SQLITE_SCHEMA[table]]
+        if unknown: raise ValueError(f"{table}: unbekannte Spalten {unknown}")
+        sql = f"INSERT INTO {table} ({', '.join(cols)}) VALUES ({', '.join('?' * len(cols))})"
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(sql, rows)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK"); raise
+
+    def query(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def deal_counts(self):
+        """Live-Stand je Bedingung: {condition: (sessions, deals, Ø Deal-Preis)}."""
+        rows = self.query(
+            "SELECT condition, COUNT(*), SUM(final_price_eur > 0), "
+            "AVG(CASE WHEN final_price_eur > 0 THEN final_price_eur END) FROM outcomes GROUP BY condition")
+        return {c: (n, d or 0, avg) for c, n, d, avg in rows}
+
+    def export_csv(self, out_dir):
+        """outcomes.csv, survey.csv, sessions.csv und transcript_<id>.csv im alten Layout schreiben."""
+        out_dir = Path(out_dir); out_dir.mkdir(parents=True, exist_ok=True)
+        counts = {}
+        for table, fname in (("outcomes", "outcomes.csv"), ("survey", "survey.csv"), ("sessions", "sessions.csv"),
+                             ("llm_breaker", "llm_breaker.csv"), ("llm_calls", "llm_calls.csv")):
+            cols = SQLITE_SCHEMA[table]
+            rows = self.query(f"SELECT {', '.join(cols)} FROM {table} ORDER BY id")
+            with (out_dir / fname).open("w", newline="", encoding="utf-8") as f:
+                w = csv.writer(f); w.writerow(cols); w.writerows(rows)
+            counts[table] = len(rows)
+        cols = SQLITE_SCHEMA["transcripts"]
+        sessions = [r[0] for r in self.query("SELECT DISTINCT session_id FROM transcripts")]
+        for sid in sessions:
+            rows = self.query(f"SELECT {', '.join(cols)} FROM transcripts WHERE session_id=? ORDER BY id", (sid,))
+            with (out_dir / f"transcript_{sid}.csv").open("w", newline="", encoding="utf-8") as f:
+                w = csv.writer(f); w.writerow(cols); w.writerows(rows)
+        counts["transcripts"] = len(sessions)
+        return counts
+
+    def close(self):
+        with self._lock: self._conn.close()
+
+class _SqliteTable:
+    """Schreibziel für TranscriptBuffer/BackgroundWriter (gleiche append_rows-Schnittstelle)."""
+    def __init__(self, store, name):
+        self.store, self.name = store, name
+    def append_rows(self, header, rows):
+        self.store.insert_rows(self.name, header, rows)
+
+def sqlite_store(log_dir):
+    """Prozessweiter SqliteStore unter `<log_dir>/negotiation.db`."""
+    path = (Path(log_dir) / "negotiation.db").resolve()
+    with _STORES_LOCK:
+        if path not in _STORES: _STORES[path] = SqliteStore(path)
+        return _STORES[path]
+
+# ============== Backend-Auswahl ==============
+def transcript_target(csv_path):
+    """Ziel für Transkriptzeilen: die Session-CSV oder der gemeinsame Store (LOG_BACKEND)."""
+    csv_path = Path(csv_path)
+    if LOG_BACKEND == "events": return event_store(csv_path.parent)
+    if LOG_BACKEND == "sqlite": return sqlite_store(csv_path.parent).table("transcripts")
+    return csv_path
+
+def table_target(csv_path, table):
+    """Ziel für outcomes/survey/sessions: die gemeinsame CSV oder (LOG_BACKEND=sqlite) die Tabelle."""
+    csv_path = Path(csv_path)
+    if LOG_BACKEND == "sqlite": return sqlite_store(csv_path.parent).table(table)
+    return csv_path
+
+def append_rows(target, header, rows):
+    if hasattr(target, "append_rows"):
+        target.append_rows(header, rows); return
+    is_new = not target.exists()
+    with target.open("a", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        if is_new: w.writerow(header)
+        w.writerows(rows)
+
+def write_transcript_row(csv_path, header, row):
+    """Einzelzeile ungepuffert schreiben (für die Varianten ohne TranscriptBuffer)."""
+    append_rows(transcript_target(csv_path), header, [row])
+
+def write_table_row(csv_path, table, header, row):
+    """Outcome-/Survey-Zeile für die CSV bzw. (LOG_BACKEND=sqlite) die Tabelle einreihen.
+
+    Geht über den BackgroundWriter: nur dessen Thread hängt an die gemeinsamen Dateien an,
+    auch in den Varianten ohne eigenes Logging-Panel – keine halben Zeilen mehr.
+    """
+    background_writer().submit(table_target(csv_path, table), header, row)
+
+# ============== Transkript-Puffer ==============
+_LIVE_BUFFERS = weakref.WeakSet()
+
+class TranscriptBuffer:
+    """Hält Transkriptzeilen einer Session im Speicher und schreibt sie gebündelt.
+
+    Flush passiert automatisch bei `max_rows` Zeilen oder wenn die älteste Zeile
+    `max_age_s` Sekunden wartet; sonst explizit (Rerun-Ende, Abschluss) bzw. beim
+    Prozessende über atexit. Ziel ist eine CSV-Datei oder ein EventStore.
+    """
+    def __init__(self, target, header=TRANSCRIPT_HEADER, max_rows=25, max_age_s=10.0):
+        self.target = Path(target) if isinstance(target, (str, os.PathLike)) else target
+        self.header = list(header)
+        self.max_rows = max_rows
+        self.max_age_s = max_age_s
+        self._rows = []
+        self._oldest = None
+        self._lock = threading.Lock()
+        _LIVE_BUFFERS.add(self)
+
+    def __len__(self):
+        return len(self._rows)
+
+    def add(self, row):
+        with self._lock:
+            if not self._rows: self._oldest = time.monotonic()
+            self._rows.append(list(row))
+            due = len(self._rows) >= self.max_rows or (time.monotonic() - self._oldest) >= self.max_age_s
+        if due: self.flush()
+
+    def flush(self) -> int:
+        with self._lock:
+            if not self._rows: return 0
+            rows, self._rows = self._rows, []
+            try:
+                append_rows(self.target, self.header, rows)
+            except Exception:
+                self._rows = rows + self._rows   # nichts verlieren – nächster Flush versucht es erneut
+                raise
+            return len(rows)
+
+# ============== Hintergrund-Writer für gemeinsame CSVs ==============
+class BackgroundWriter:
+    """Ein Thread pro Prozess, der Zeilen für gemeinsame CSV-Dateien gebündelt anhängt.
+
+    Statt eines Pfads kann auch ein Store-Ziel (z. B. SQLite-Tabelle) übergeben werden;
+    dann wird der Batch per `append_rows` in einem Rutsch eingefügt.
+
+    `submit()` blockiert nie; der Thread sammelt bis zu `batch_max` Einträge (oder
+    `batch_wait_s`), schreibt pro Datei einmal und ruft spätestens alle `fsync_every_s`
+    os.fsync auf. Da nur dieser Thread schreibt, können sich Zeilen verschiedener
+    Sessions nicht mehr vermischen. `close()` leert die Queue vollständig.
+
+    Schlägt ein Schreiben fehl, wird das gecachte Dateiobjekt verworfen und der Batch
+    nach `retry_backoff_s` synchron (frisch geöffnet) erneut geschrieben; klappt auch das
+    nicht, landen die Zeilen als JSONL in `spill/<ziel>.jsonl` neben dem Ziel, im
+    schlimmsten Fall auf stderr – Zeilen verschwinden nie nur in einem Zähler.
+    """
+    def __init__(self, batch_max=200, batch_wait_s=0.25, fsync_every_s=2.0, retry_backoff_s=(0.1, 0.5, 2.0)):
+        self.batch_max = batch_max
+        self.retry_backoff_s = tuple(retry_backoff_s)
+        self.batch_wait_s = batch_wait_s
+        self.fsync_every_s = fsync_every_s
+        self._q = queue.Queue()
+        self._files = {}                  # Path -> offenes Dateiobjekt
+        self._dirty = set()
+        self._last_fsync = time.monotonic()
+        self._closed = False
+        self._stats_lock = threading.Lock()
+        self._stats = dict(enqueued=0, written=0, batches=0, errors=0, retried=0, spilled=0, lost=0, fsyncs=0,
+                           last_flush_ms=0.0, max_flush_ms=0.0, total_flush_ms=0.0)
+        self._thread = threading.Thread(target=self._run, name="csv-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, target, header, row):
+        """Zeile (Liste oder Dict passend zu `header`) für `target` einreihen."""
+        if self._closed: raise RuntimeError("BackgroundWriter ist geschlossen")
+        if isinstance(row, dict): row = [row.get(h, "") for h in header]
+        if isinstance(target, (str, os.PathLike)): target = Path(target)
+        self._q.put((target, tuple(header), list(row)))
+        with self._stats_lock: self._stats["enqueued"] += 1
+
+    def stats(self):
+        with self._stats_lock:
+            s = dict(self._stats)
+        s["queue_depth"] = self._q.qsize()
+        s["avg_flush_ms"] = s["total_flush_ms"] / s["batches"] if s["batches"] else 0.0
+        return s
+
+    def _run(self):
+        while True:
+            item = self._q.get()
+            if item is None: break
+            batch = [item]
+            deadline = time.monotonic() + self.batch_wait_s
+            stop = False
+            while len(batch) < self.batch_max:
+                try: nxt = self._q.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty: break
+                if nxt is None: stop = True; break
+                batch.append(nxt)
+            self._write_batch(batch)
+            if stop: break
+        self._fsync(force=True)
+        for f in self._files.values(): f.close()
+        self._files.clear()
+
+    def _write_batch(self, batch):
+        t0 = time.perf_counter()
+        by_path = {}
+        for path, header, row in batch:
+            by_path.setdefault((path, header), []).append(row)
+        written = 0
+        for (path, header), rows in by_path.items():
+            try:
+                self._append(path, header, rows); written += len(rows)
+            except Exception as e:
+                with self._stats_lock: self._stats["errors"] += 1
+                self._drop_handle(path)
+                if self._retry(path, header, rows): written += len(rows)
+                else: self._spill(path, header, rows, e)
+        self._fsync()
+        ms = (time.perf_counter() - t0) * 1000
+        with self._stats_lock:
+            st = self._stats
+            st["written"] += written; st["batches"] += 1
+            st["last_flush_ms"] = ms; st["max_flush_ms"] = max(st["max_flush_ms"], ms); st["total_flush_ms"] += ms
+
+    def _append(self, path, header, rows):
+        if hasattr(path, "append_rows"):
+            path.append_rows(list(header), rows); return
+        f = self._files.get(path)
+        if f is None:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            f = self._files[path] = path.open("a", newline="", encoding="utf-8")
+        w = csv.writer(f)
+        if f.tell() == 0: w.writerow(header)
+        w.writerows(rows); f.flush()
+        self._dirty.add(path)
+
+    def _drop_handle(self, path):
+        f = self._files.pop(path, None); self._dirty.discard(path)
+        if f is not None:
+            try: f.close()
+            except Exception: pass
+
+    def _retry(self, path, header, rows):
+        """Synchron mit Backoff nachschreiben (ohne gecachtes Dateiobjekt); True bei Erfolg."""
+        for pause in self.retry_backoff_s:
+            time.sleep(pause)
+            with self._stats_lock: self._stats["retried"] += 1
+            try:
+                if isinstance(path, Path): path.parent.mkdir(parents=True, exist_ok=True)
+                append_rows(path, list(header), rows); return True
+            except Exception:
+                with self._stats_lock: self._stats["errors"] += 1
+        return False
+
+    def _spill(self, path, header, rows, exc):
+        """Letzter Ausweg: Zeilen als JSONL ablegen (oder auf stderr), nie stillschweigend verwerfen."""
+        recs = [json.dumps({"target": str(getattr(path, "name", path)), "error": repr(exc),
+                            "row": dict(zip(header, row))}, ensure_ascii=False, default=str) for row in rows]
+        try:
+            sp = _spill_path(path); sp.parent.mkdir(parents=True, exist_ok=True)
+            with sp.open("a", encoding="utf-8") as f: f.write("\n".join(recs) + "\n")
+            with self._stats_lock: self._stats["spilled"] += len(rows)
+            print(f"[log_store] {len(rows)} Zeilen für {path} nicht schreibbar ({exc!r}) -> {sp}", file=sys.stderr)
+        except Exception as e2:
+            with self._stats_lock: self._stats["lost"] += len(rows)
+            print(f"[log_store] {len(rows)} Zeilen für {path} weder schreib- noch auslagerbar ({exc!r}, {e2!r}):",
+                  *recs, sep="\n", file=sys.stderr)
+
+    def _fsync(self, force=False):
+        if not self._dirty: return
+        if not force and time.monotonic() - self._last_fsync < self.fsync_every_s: return
+        for path in list(self._dirty):
+            try: os.fsync(self._files[path].fileno())
+            except Exception: pass
+        self._dirty.clear(); self._last_fsync = time.monotonic()
+        with self._stats_lock: self._stats["fsyncs"] += 1
+
+    def close(self, timeout=10.0):
+        """Queue leeren, letzte Batches schreiben + fsync, Thread beenden."""
+        if self._closed: return
+        self._closed = True
+        self._q.put(None)
+        self._thread.join(timeout)
+
+def _spill_path(target):
+    """spill/<ziel>.jsonl neben der CSV bzw. der Datenbank."""
+    if isinstance(target, Path): return target.parent / "spill" / f"{target.stem}.jsonl"
+    store = getattr(target, "store", None)
+    if store is not None: return store.path.parent / "spill" / f"{target.name}.jsonl"
+    return Path("spill") / "rows.jsonl"
+
+_WRITER = None
+_WRITER_LOCK = threading.Lock()
+
+def background_writer():
+    """Prozessweiter BackgroundWriter (lazy gestartet)."""
+    global _WRITER
+    with _WRITER_LOCK:
+        if _WRITER is None: _WRITER = BackgroundWriter()
+        return _WRITER
+
+def flush_all_buffers():
+    for buf in list(_LIVE_BUFFERS):
+        try: buf.flush()
+        except Exception: pass
+    if _WRITER is not None:
+        _WRITER.close()
+    for store in list(_STORES.values()):
+        store.close()
+
+atexit.register(flush_all_buffers)
+
+# ============== CLI ==============
+def _main(argv=None):
+    ap = argparse.ArgumentParser(description="Event-Store der Verhandlungs-Apps verwalten.")
+    ap.add_argument("--logs", default="logs", help="LOG_DIR der App (Standard: logs)")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    ex = sub.add_parser("export", help="Sessions als transcript_<id>.csv exportieren")
+    ex.add_argument("--out", default=None, help="Zielordner (Standard: LOG_DIR)")
+    ex.add_argument("--session", action="append", help="nur diese session_id (mehrfach möglich)")
+    sub.add_parser("list", help="bekannte session_ids ausgeben")
+    sub.add_parser("reindex", help="index.tsv aus den Segmenten neu aufbauen")
+    sx = sub.add_parser("sqlite-export", help="negotiation.db als CSV-Dateien im alten Layout exportieren")
+    sx.add_argument("--out", required=True, help="Zielordner")
+    sub.add_parser("sqlite-stats", help="Sessions/Deals je Bedingung aus negotiation.db")
+    args = ap.parse_args(argv)
+
+    if args.cmd.startswith("sqlite-"):
+        db = SqliteStore(Path(args.logs) / "negotiation.db")
+        if args.cmd == "sqlite-export":
+            for k, n in db.export_csv(args.out).items(): print(f"{k}: {n}")
+        else:
+            for cond, (n, deals, avg) in sorted(db.deal_counts().items()):
+                print(f"{cond}: {n} Sessions, {deals} Deals, Ø Deal-Preis {avg or 0:.1f} €")
+        db.close()
+        return
+
+    store = EventStore(Path(args.logs) / "events")
+    if args.cmd == "list":
+        for sid in store.sessions(): print(sid)
+    elif args.cmd == "reindex":
+        store.rebuild_index(); print(f"{len(store.sessions())} Sessions indiziert.")
+    elif args.cmd == "export":
+        out = Path(args.out or args.logs); out.mkdir(parents=True, exist_ok=True)
+        for sid in (args.session or store.sessions()):
+            n = store.export_session_csv(sid, out / f"transcript_{sid}.csv")
+            print(f"{sid}: {n} Zeilen")
+    store.close()
+
+if __name__ == "__main__":
+    _main()
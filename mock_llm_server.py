@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+# =============================================================================
+# Lokaler Ersatz für den OpenAI-Chat-Completions-Endpunkt (nur Standardbibliothek)
+# - POST /v1/chat/completions (mit und ohne stream=True, SSE wie bei OpenAI)
+# - GET /v1/models[/<id>] (für warm_up), GET /stats (Zähler als JSON)
+# - Antwortzeit bis zum ersten Token und pro Token aus konfigurierbaren
+#   Verteilungen: fixed:x | uniform:a,b | lognormal:median,sigma | exp:mean
+# - Fehlerquoten: 500, 429 mit Retry-After, hängende Anfragen, Regelverstöße
+#   (verbotener Preis im Text, für den OutputGuard)
+# - Prompt-Caching wie beim Provider: wiederholter System-Prompt ab
+#   --cache-min-tokens (OpenAI: 1024) zählt in 128er-Schritten als cached_tokens
+# - Antworttext nennt das Gegenangebot aus dem User-Prompt ("Gegenangebot ...: X €")
+#
+# Aufruf:  python mock_llm_server.py [--port 8001] [--latency lognormal:0.6,0.5]
+#                                    [--error-rate 0.02] [--rate-limit-rate 0.01] ...
+# App/Harness darauf lenken:  OPENAI_BASE_URL=http://127.0.0.1:8001/v1 OPENAI_API_KEY=mock
+# =============================================================================
+
+import argparse
+import json
+import math
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+OFFER_RE = re.compile(r"Gegenangebot[^:\n]*:\s*(\d+)")
+
+TEMPLATES = {
+    "neutral": ["Für ein neues, originalverpacktes iPad finde ich {offer} € fair.",
+                "Ich verstehe dich, aber {offer} € ist für Neuware ein guter Preis.",
+                "Es ist ungeöffnet und sofort verfügbar – {offer} € wäre mein Vorschlag."],
+    "power":   ["{offer} €. Neuware, versiegelt – darunter reden wir nicht.",
+                "Der Markt kennt den Wert. Mein Angebot: {offer} €.",
+                "Unrealistisch. {offer} € für ein neues Gerät, mehr Spielraum gibt es nicht."],
+}
+
+class Latency:
+    """Zufallsverteilung aus einer kurzen Spezifikation, z. B. "lognormal:0.6,0.5"."""
+    def __init__(self, spec):
+        self.spec = spec
+        kind, _, args = spec.partition(":")
+        self.kind = kind
+        self.args = [float(a) for a in args.split(",") if a]
+        if kind not in ("fixed", "uniform", "lognormal", "exp"):
+            raise ValueError(f"unbekannte Verteilung: {spec}")
+
+    def sample(self):
+        a = self.args
+        if self.kind == "fixed": return a[0]
+        if self.kind == "uniform": return random.uniform(a[0], a[1])
+        if self.kind == "lognormal": return random.lognormvariate(math.log(a[0]), a[1])
+        return random.expovariate(1 / a[0])
+
+class MockConfig:
+    def __init__(self, latency="lognormal:0.6,0.5", token_delay="fixed:0.02", error_rate=0.0,
+                 rate_limit_rate=0.0, retry_after=1.0, hang_rate=0.0, hang_s=30.0, violation_rate=0.0,
+                 cache_min_tokens=1024):
+        self.latency = Latency(latency)
+        self.token_delay = Latency(token_delay)
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.hang_rate = hang_rate
+        self.hang_s = hang_s
+        self.violation_rate = violation_rate
+        self.cache_min_tokens = cache_min_tokens
+        self._prefixes = set()
+        self._lock = threading.Lock()
+        self.counters = dict(requests=0, streamed=0, ok=0, errors=0, rate_limited=0, hung=0, violations=0)
+
+    def count(self, field):
+        with self._lock: self.counters[field] += 1
+
+    def stats(self):
+        with self._lock: return dict(self.counters)
+
+    def cached_tokens(self, messages):
+        """Präfix-Cache: bereits gesehener System-Prompt -> seine Tokens (128er-Schritte) gelten als gecacht."""
+        system = next((m.get("content", "") for m in messages if m.get("role") == "system"), "")
+        n = len(system) // 4
+        with self._lock:
+            hit = system in self._prefixes
+            self._prefixes.add(system)
+        return n // 128 * 128 if hit and n >= self.cache_min_tokens else 0
+
+def _reply_text(messages, violate):
+    system = next((m.get("content", "") for m in messages if m.get("role") == "system"), "")
+    user = next((m.get("content", "") for m in messages if m.get("role") == "user"), "")
+    m = OFFER_RE.search(user)
+    offer = int(m.group(1)) if m else 950
+    cond = "power" if "Geschäftsmann" in system else "neutral"
+    text = random.choice(TEMPLATES[cond]).format(offer=offer)
+    if violate: text = text.replace(f"{offer} €", f"{random.choice((650, 850, 880))} €", 1)
+    return text
+
+def _tokens(text):
+    # grob wie BPE: Wörter mit folgendem Leerzeichen, Zahlen in 1–2 Stücken
+    out = []
+    for w in re.findall(r"\S+\s*", text):
+        if w[:1].isdigit() and len(w) > 3: out.extend([w[:1], w[1:]])
+        else: out.append(w)
+    return out
+
+def _usage(req, text, cached=0):
+    # grobe Schätzung: ~4 Zeichen pro Prompt-Token
+    prompt = sum(len(m.get("content", "")) // 4 for m in req.get("messages", []))
+    completion = len(_tokens(text))
+    return {"prompt_tokens": prompt, "completion_tokens": completion, "total_tokens": prompt + completion,
+            "prompt_tokens_details": {"cached_tokens": min(cached, prompt)}}
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"       # Keep-Alive wie beim echten Endpunkt
+    cfg = None                          # MockConfig, per make_server gesetzt
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def _json(self, status, payload, headers=None):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for k, v in (headers or {}).items(): self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _error(self, status, message, headers=None):
+        self._json(status, {"error": {"message": message, "type": "mock_error", "code": status}}, headers)
+
+    def do_GET(self):
+        if self.path == "/stats": return self._json(200, self.cfg.stats())
+        if self.path.startswith("/v1/models"):
+            model = self.path.rsplit("/", 1)[-1]
+            return self._json(200, {"id": model, "object": "model", "owned_by": "mock"})
+        self._error(404, "not found")
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        try: req = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError: return self._error(400, "invalid json")
+        if self.path != "/v1/chat/completions": return self._error(404, "not found")
+        cfg = self.cfg
+        cfg.count("requests")
+
+        r = random.random()
+        if r < cfg.rate_limit_rate:
+            cfg.count("rate_limited")
+            return self._error(429, "rate limited", {"Retry-After": f"{cfg.retry_after:g}"})
+        r -= cfg.rate_limit_rate
+        if r < cfg.error_rate:
+            time.sleep(cfg.latency.sample() / 2)
+            cfg.count("errors")
+            return self._error(500, "internal error")
+        r -= cfg.error_rate
+        if r < cfg.hang_rate:
+            cfg.count("hung")
+            time.sleep(cfg.hang_s)
+            return self._error(504, "upstream timeout")
+
+        violate = random.random() < cfg.violation_rate
+        if violate: cfg.count("violations")
+        text = _reply_text(req.get("messages", []), violate)
+        cached = cfg.cached_tokens(req.get("messages", []))
+        model = req.get("model", "mock")
+        cid = "chatcmpl-" + uuid.uuid4().hex[:12]
+        time.sleep(cfg.latency.sample())
+
+        if not req.get("stream"):
+            time.sleep(sum(cfg.token_delay.sample() for _ in _tokens(text)))
+            cfg.count("ok")
+            return self._json(200, {
+                "id": cid, "object": "chat.completion", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+                "usage": _usage(req, text, cached),
+            })
+
+        cfg.count("streamed")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            first = {"role": "assistant", "content": ""}
+            for i, tok in enumerate([None] + _tokens(text) + [""]):
+                if i > 1: time.sleep(cfg.token_delay.sample())
+                delta = first if tok is None else ({"content": tok} if tok else {})
+                chunk = {"id": cid, "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+                         "choices": [{"index": 0, "delta": delta, "finish_reason": "stop" if tok == "" else None}]}
+                self._chunk(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n")
+            if (req.get("stream_options") or {}).get("include_usage"):
+                chunk = {"id": cid, "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+                         "choices": [], "usage": _usage(req, text, cached)}
+                self._chunk(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n")
+            self._chunk("data: [DONE]\n\n")
+            self.wfile.write(b"0\r\n\r\n")
+            cfg.count("ok")
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True      # Client hat den Stream geschlossen (Abbruch/Hedge-Verlierer)
+
+    def _chunk(self, s):
+        data = s.encode("utf-8")
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Client schließt Keep-Alive-Verbindungen/Streams – kein Fehler des Mocks
+        if isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)): return
+        super().handle_error(request, client_address)
+
+def make_server(cfg, host="127.0.0.1", port=8001):
+    handler = type("MockHandler", (Handler,), {"cfg": cfg})
+    return MockServer((host, port), handler)
+
+def serve_in_thread(cfg, host="127.0.0.1", port=0):
+    """Server im Hintergrund starten (port=0: freier Port); liefert (server, base_url)."""
+    server = make_server(cfg, host, port)
+    threading.Thread(target=server.serve_forever, name="mock-llm", daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/v1"
+
+def add_mock_args(ap):
+    ap.add_argument("--latency", default="lognormal:0.6,0.5", help="Zeit bis zum ersten Token (Standard: lognormal:0.6,0.5)")
+    ap.add_argument("--token-delay", default="fixed:0.02", help="Zeit pro weiterem Token (Standard: fixed:0.02)")
+    ap.add_argument("--error-rate", type=float, default=0.0, help="Anteil HTTP 500")
+    ap.add_argument("--rate-limit-rate", type=float, default=0.0, help="Anteil HTTP 429")
+    ap.add_argument("--retry-after", type=float, default=1.0, help="Retry-After bei 429 in Sekunden")
+    ap.add_argument("--hang-rate", type=float, default=0.0, help="Anteil hängender Anfragen")
+    ap.add_argument("--hang-s", type=float, default=30.0, help="so lange hängt eine Anfrage")
+    ap.add_argument("--violation-rate", type=float, default=0.0, help="Anteil Antworten mit verbotenem Preis")
+    ap.add_argument("--cache-min-tokens", type=int, default=1024,
+                    help="ab so vielen System-Prompt-Tokens wird ein wiederholter Präfix gecacht (Standard: 1024)")
+
+def config_from_args(args):
+    return MockConfig(args.latency, args.token_delay, args.error_rate, args.rate_limit_rate,
+                      args.retry_after, args.hang_rate, args.hang_s, args.violation_rate, args.cache_min_tokens)
+
+def _main(argv=None):
+    ap = argparse.ArgumentParser(description="Lokaler OpenAI-kompatibler Mock für Lasttests.")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8001)
+    add_mock_args(ap)
+    args = ap.parse_args(argv)
+    server = make_server(config_from_args(args), args.host, args.port)
+    print(f"Mock läuft auf http://{args.host}:{args.port}/v1 – Strg+C beendet.")
+    try: server.serve_forever()
+    except KeyboardInterrupt: pass
+    finally: server.server_close()
+
+if __name__ == "__main__":
+    _main()
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+# =============================================================================
+# Vorab generierte Phrasenbank für die LLM-Rhetorik
+# - Situationen sind endlich: 2 Bedingungen × Phasen aus _compute_counter_numbers
+#   × Gegenangebote im 5-€-Raster von 895 bis 1000 €
+# - Batch-Job erzeugt N Varianten pro Kombination (gleiche Prompts wie die App)
+#   und schreibt sie kompakt nach phrase_bank.json.gz
+# - die App lädt die Datei einmal pro Prozess und liefert Treffer in µs;
+#   Live-API-Aufrufe werden damit optional (LLM_RUNTIME_CALLS=0)
+#
+# Aufruf:  python phrase_bank.py generate --n 5 [--out phrase_bank.json.gz] [--workers 8] [--resume]
+#          python phrase_bank.py stats
+# =============================================================================
+
+import argparse
+import gzip
+import json
+import os
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from pathlib import Path
+
+PHRASE_BANK_PATH = os.getenv("PHRASE_BANK_PATH", "phrase_bank.json.gz")
+
+CONDITIONS = ["neutral", "power"]
+PHASES = ["tier1_lowball", "tier2_lowball", "tier3_lowball", "early_rounds", "late_near_floor",
+          "late_subfloor_rare", "mid_low", "at_or_above_list", "no_price"]
+OFFERS = list(range(895, 1001, 5))
+LIST_PRICE = 1000
+
+# repräsentatives Nutzerangebot je Lowball-Phase (für den Power-Zusatz im Prompt)
+PHASE_USER_OFFER = {"tier1_lowball": 350, "tier2_lowball": 450, "tier3_lowball": 550}
+# allgemeine Begründungen statt nutzerspezifischer Argumente
+GENERIC_ARGS = [
+    "Es ist neu & originalverpackt – ohne Nutzungsspuren.",
+    "Du hast es sofort verfügbar, ohne Lieferzeiten.",
+    "Der Originalpreis liegt bei 1.000 €; knapp darunter ist für Neuware fair.",
+    "Neu/OVP hält den Wiederverkaufswert deutlich besser.",
+]
+
+def bank_key(condition, phase, bot_offer):
+    offer = int(round(bot_offer / 5) * 5)
+    return f"{condition}|{phase}|{offer}"
+
+# ============== Laden & Ausspielen (App) ==============
+_bank = None
+_lock = threading.Lock()
+
+def load(path=None):
+    """Bank einmal pro Prozess laden; False, wenn keine Datei vorhanden ist."""
+    global _bank
+    with _lock:
+        if _bank is None:
+            p = Path(path or PHRASE_BANK_PATH)
+            try:
+                with gzip.open(p, "rt", encoding="utf-8") as f:
+                    _bank = json.load(f).get("bank", {})
+            except (OSError, ValueError):
+                _bank = {}
+        return bool(_bank)
+
+def size():
+    return sum(len(v) for v in (_bank or {}).values())
+
+def pick(condition, phase, bot_offer, avoid=()):
+    """Zufällige Variante für die Situation, die noch nicht im Chat steht – sonst None."""
+    if _bank is None: load()
+    variants = _bank.get(bank_key(condition, phase, bot_offer)) if bot_offer is not None else None
+    if not variants: return None
+    fresh = [t for t in variants if t not in avoid]
+    return random.choice(fresh) if fresh else None
+
+# ============== Generator (Batch) ==============
+def _valid(text, offer):
+    """Dieselbe Prüfung wie live (llm_client.OutputGuard): Gegenangebot genannt,
+    keine Beträge unter 895 €, kein anderes Angebot, kein Mindestpreis."""
+    import llm_client
+    return llm_client.check_text(text, offer, LIST_PRICE)
+
+def _generate_one(condition, phase, offer, i):
+    import llm_client
+    extra = llm_client.rebuke_hint(condition, PHASE_USER_OFFER.get(phase))
+    arg = GENERIC_ARGS[i % len(GENERIC_ARGS)]
+    system, user = llm_client.prompts(condition, offer, phase, arg, extra, LIST_PRICE)
+    temp = 0.8 if condition == "neutral" else 0.9     # etwas wärmer als live -> mehr Abwechslung
+    for _ in range(3):
+        out = llm_client.chat(system, user, temperature=temp, max_tokens=120)
+        if out and _valid(out, offer): return out
+    return None
+
+def generate(n, out_path, workers=8, resume=False):
+    out_path = Path(out_path)
+    bank = {}
+    if resume and out_path.exists():
+        with gzip.open(out_path, "rt", encoding="utf-8") as f:
+            bank = json.load(f).get("bank", {})
+    jobs = []
+    for c in CONDITIONS:
+        for ph in PHASES:
+            for o in OFFERS:
+                have = len(bank.get(bank_key(c, ph, o), []))
+                jobs.extend((c, ph, o, i) for i in range(have, n))
+    print(f"{len(jobs)} Generierungen ausstehend ({len(CONDITIONS)*len(PHASES)*len(OFFERS)} Kombinationen × {n}).")
+    failed = 0
+    with ThreadPoolExecutor(max_workers=workers) as ex:
+        futs = {ex.submit(_generate_one, *job): job for job in jobs}
+        for k, fut in enumerate(as_completed(futs), start=1):
+            c, ph, o, _ = futs[fut]
+            text = fut.result()
+            if text is None: failed += 1; continue
+            variants = bank.setdefault(bank_key(c, ph, o), [])
+            if text not in variants: variants.append(text)
+            if k % 100 == 0: print(f"  {k}/{len(jobs)}")
+    import llm_client
+    payload = {"meta": {"generated_utc": datetime.utcnow().isoformat(), "model": llm_client.OPENAI_MODEL,
+                        "variants_per_key": n},
+               "bank": bank}
+    tmp = out_path.with_suffix(out_path.suffix + ".tmp")
+    with gzip.open(tmp, "wt", encoding="utf-8") as f:
+        json.dump(payload, f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(tmp, out_path)
+    print(f"Fertig: {sum(len(v) for v in bank.values())} Varianten in {len(bank)} Situationen, {failed} Fehlversuche.")
+
+def _main(argv=None):
+    ap = argparse.ArgumentParser(description="Phrasenbank für die LLM-Rhetorik erzeugen/prüfen.")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    g = sub.add_parser("generate", help="Varianten per OpenAI-API erzeugen (OPENAI_API_KEY nötig)")
+    g.add_argument("--n", type=int, default=5, help="Varianten pro Kombination (Standard: 5)")
+    g.add_argument("--out", default=PHRASE_BANK_PATH)
+    g.add_argument("--workers", type=int, default=8, help="parallele API-Aufrufe (Standard: 8)")
+    g.add_argument("--resume", action="store_true", help="bestehende Datei ergänzen statt neu erzeugen")
+    s = sub.add_parser("stats", help="Abdeckung einer bestehenden Bank anzeigen")
+    s.add_argument("--path", default=PHRASE_BANK_PATH)
+    sub.add_parser("check", help="Regressionsfälle der Preisprüfung (llm_client.GUARD_CASES) laufen lassen")
+    args = ap.parse_args(argv)
+
+    if args.cmd == "generate":
+        generate(args.n, args.out, args.workers, args.resume)
+    elif args.cmd == "check":
+        import llm_client
+        bad = llm_client.guard_regressions()
+        for text, want, whole, chunked in bad:
+            print(f"FEHLER: {text!r}: erwartet {want}, am Stück {whole}, gestreamt {chunked}")
+        print(f"{len(llm_client.GUARD_CASES) - len(bad)}/{len(llm_client.GUARD_CASES)} Fälle ok.")
+        if bad: raise SystemExit(1)
+    else:
+        if not load(args.path): print("Keine Phrasenbank gefunden."); return
+        total = len(CONDITIONS) * len(PHASES) * len(OFFERS)
+        print(f"{len(_bank)}/{total} Situationen abgedeckt, {size()} Varianten.")
+
+if __name__ == "__main__":
+    _main()